@@ -1,148 +1,144 @@
-"""Main app for text to SQL"""
+"""Main app for text to SQL
 
-from typing import List
-import os
+The script is split into a cached resource layer (database, schema and pipeline,
+shared by every session) and a view layer that only renders stage results stored
+in the session state. Toggling an output setting reruns the view layer without
+re-executing any stage; heavy imports are deferred to the resource layer.
+"""
+
+import hashlib
+import json
 import logging
-from sqlite3 import connect
+import os
 import time
-import json
 
-import pandas as pd
-import requests
 import streamlit as st
-import sqlparse
 
-MAX_UNIQUE = 5
-API = "http://127.0.0.1:8000/inference"
+from bsql import telemetry
+from bsql.sql.connections import ConnectionManager
+
 DATASET_PATH = "data"
+AVATAR = "https://ask.vanna.ai/static/img/vanna_circle.png"
 
 _LOG = logging.getLogger(__name__)
 _LOG.setLevel(logging.INFO)
 
+_SCRIPT_START = time.perf_counter()
 
-def load_data(dataset_path: str, conn, with_samples=True) -> str:
-    """Load dataset from data folder
 
-    Args:
-        dataset_path (str): path to data folder with files in .csv
-        is_unique (bool, optional): whether to include sample values. Defaults to True.
+# ---------------------------------------------------------------------------
+# Resource layer
+# ---------------------------------------------------------------------------
 
-    Returns:
-        str: schema
-    """
-    # TODO: Add adaptors for different datasets
-    files = os.listdir(DATASET_PATH)
-
-    def snake_case(string: str) -> str:
-        """Convert string to snake case"""
-        return string.lower().replace(" ", "_")
-
-    table_to_df = {}
-
-    for file in files:
-        if not file.endswith("csv"):
-            continue
-        file_path = os.path.join(dataset_path, file)
-        df = pd.read_csv(file_path)
-        df.columns = map(snake_case, df.columns)
-
-        file = file.split(".")[0]
-        df.to_sql(file, conn, if_exists="replace", index=False)
-        table_to_df[file] = df
-
-    schema_raw = conn.execute("SELECT * FROM sqlite_master").fetchall()
-    new_schema = ""
-    old_schema = ""
-    for table in schema_raw:
-        table_name = table[1]
-        df = table_to_df[table_name]
-        old_schema += f"{table[-1]}\n\n"
-        rows = table[-1].split("\n")
-        for index, row in enumerate(rows):
-            new_schema += row
-            col = df.columns
-            if index in [0, len(rows) - 1]:
-                new_schema += "\n" if index == 0 else "\n\n"
-                continue
-            uniques = df[col[index - 1]].unique().tolist()
-            to_add_str = ", ".join(
-                [str(uniques[i]) for i in range(min(len(uniques), MAX_UNIQUE))]
-            )
 
-            new_schema += f"-- Sample values like: [{to_add_str}]\n"
-    return new_schema if with_samples else old_schema
+def dataset_version(dataset_path: str) -> str:
+    """Fingerprint of the csv files, changes whenever a file is added or edited"""
+    digest = hashlib.sha1()
+    for file in sorted(os.listdir(dataset_path)):
+        if file.endswith("csv"):
+            stat = os.stat(os.path.join(dataset_path, file))
+            digest.update(f"{file}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return digest.hexdigest()
 
 
-def post(data: dict) -> str:
-    """Post data to API"""
-    response = requests.post(
-        API,
-        json=data,
-        headers={"Content-Type": "application/json"},
-        timeout=5000,
-    )
-    return response.json()
+@st.cache_resource
+def get_pipeline():
+    """Import the pipeline (pandas, requests, sqlparse) once per process"""
+    if os.environ.get("BSQL_METRICS_PORT"):
+        telemetry.start_metrics_server(int(os.environ["BSQL_METRICS_PORT"]))
 
+    from bsql import pipeline  # pylint: disable=import-outside-toplevel
 
-def sqlcoder_inference(question: str, schema: str) -> str:
-    """Get SQL query from SQLCoder model"""
-    data = {"question": question, "schema": schema, "model_name": "sqlcoder"}
-    response = post(data)
-    return response
+    return pipeline
 
 
-def llama_inference(query_result: str) -> str:
-    """Get data insights from llama"""
-    data = {"prompt": query_result, "model_name": "data2viz"}
-    response = post(data)
-    return response
+@st.cache_resource(show_spinner="Loading data...")
+def get_database(version: str):
+    """Connection manager and schema for a version of the dataset
 
+    Every session reads through its own pooled read-only connection, so one user's
+    long query does not block another's.
+    """
+    _LOG.info("Loading dataset version %s", version)
+    database = ConnectionManager()
+    with database.writer() as conn:
+        schema = get_pipeline().load_data(DATASET_PATH, conn)
+    return database, schema
 
-def vegalite_inference(question: str, query_result: str) -> str:
-    """Get vegalite json"""
-    data = {
-        "question": question,
-        "query_result": query_result,
-        "model_name": "data2viz",
-    }
-    response = post(data)
-    return response
 
+@st.cache_resource
+def data_reloads() -> dict:
+    """Count of "Reload Data" clicks shared by every session of the process"""
+    return {"count": 0}
 
-def followup_questions_inference(question: str) -> List[str]:
-    """Get follow-up questions"""
-    data = {"questoin": question, "model_name": "followup"}
-    response = post(data)
-    return response
 
+def data_key() -> tuple:
+    """Identifies the data stage results were computed from, in every session"""
+    return dataset_version(DATASET_PATH), data_reloads()["count"]
 
-def extract_json_from_text(input_text: str) -> dict:
-    """Extract JSON from text"""
-    try:
-        start_index = input_text.find("{")
-        end_index = input_text.rfind("}") + 1
-        json_text = input_text[start_index:end_index]
-        json_object = json.loads(json_text)
-        return json_object
 
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-        return None
+def reload_data():
+    """Drop the cached database and every stage result computed from it"""
+    get_database.clear()
+    data_reloads()["count"] += 1
+    st.session_state["results"] = {}
 
 
-def generate_visualization(question: str, df: pd.DataFrame) -> None:
-    """Generate visualization"""
-    data_header = json.dumps(df.head().to_dict(orient="records"))
-    code = vegalite_inference(question, data_header)
-    return extract_json_from_text(code)
+def get_result(question: str) -> dict:
+    """Stage results of a question, computed at most once per session and dataset
 
+    Results are keyed by ``data_key`` too, so a changed dataset or a reload from
+    any session recomputes them. A failure is stored as the result as well, so
+    only "Rerun" retries it.
+    """
+    current = data_key()
+    results = st.session_state.setdefault("results", {})
+    key = (current, question)
+    if key not in results:
+        # Results of older data are never shown again
+        for stale in [k for k in results if k[0] != current]:
+            del results[stale]
+        pipeline = get_pipeline()
+        database, schema = get_database(current[0])
+        sql = None
+        with telemetry.trace(), database.reader() as conn:
+            try:
+                sql = pipeline.generate_sql(question, schema, conn=conn)
+                df = pipeline.execute_sql(sql, conn)
+            except Exception as e:  # pylint: disable=broad-except
+                _LOG.warning("Failed to answer %r: %s", question, e)
+                if sql is not None:
+                    pipeline.sql_cache.add(question, schema, sql, success=False)
+                results[key] = {"sql": sql, "error": str(e)}
+                return results[key]
+            pipeline.sql_cache.add(question, schema, sql, success=True)
+            results[key] = {"sql": sql, "df": df}
+    return results[key]
+
+
+def get_stage(question: str, stage: str, compute):
+    """Result of an optional stage, computed the first time it is shown"""
+    result = get_result(question)
+    if stage not in result:
+        with telemetry.trace():
+            result[stage] = compute(result)
+    return result[stage]
+
+
+# ---------------------------------------------------------------------------
+# View layer
+# ---------------------------------------------------------------------------
 
-conn = connect(":memory:")
-schema = load_data(DATASET_PATH, conn)
 
+def set_question(question):
+    st.session_state["my_question"] = question
 
-def setup_session_state():
-    st.session_state["my_question"] = None
+
+def rerun_question():
+    """Recompute every stage of the current question"""
+    st.session_state.get("results", {}).pop(
+        (data_key(), st.session_state.get("my_question")), None
+    )
 
 
 st.set_page_config(layout="wide")
@@ -152,93 +148,107 @@ st.sidebar.checkbox("Show Table", value=True, key="show_table")
 st.sidebar.checkbox("Show VegaLite JSON", value=True, key="show_vegalite_json")
 st.sidebar.checkbox("Show Chart", value=True, key="show_chart")
 st.sidebar.checkbox("Show Follow-up Questions", value=True, key="show_followup")
-st.sidebar.button("Rerun", on_click=setup_session_state, use_container_width=True)
+st.sidebar.button("Rerun", on_click=rerun_question, use_container_width=True)
+st.sidebar.button("Reload Data", on_click=reload_data, use_container_width=True)
 
 st.title("Business SQL")
-st.sidebar.write(st.session_state)
-
-
-def set_question(question):
-    st.session_state["my_question"] = question
-
-
-assistant_message_suggested = st.chat_message(
-    "assistant", avatar="https://ask.vanna.ai/static/img/vanna_circle.png"
-)
-
-my_question = st.session_state.get("my_question", default=None)
-
-if my_question is None:
-    my_question = st.chat_input(
-        "Ask me a question about your data",
-    )
 
+new_question = st.chat_input("Ask me a question about your data")
+if new_question:
+    set_question(new_question)
+my_question = st.session_state.get("my_question")
 
 if my_question:
-    st.session_state["my_question"] = my_question
     user_message = st.chat_message("user")
     user_message.write(f"{my_question}")
 
-    sql = sqlcoder_inference(my_question, schema)
-    sql = sqlparse.format(sql, reident=True)
-    assistant_message_sql = st.chat_message(
-        "assistant", avatar="https://ask.vanna.ai/static/img/vanna_circle.png"
-    )
-    assistant_message_sql.code(f"""{sql}""", language="sql", line_numbers=True)
-
-    df = pd.read_sql(sql, conn)
-    if df is not None:
-        st.session_state["df"] = df
-
-    if st.session_state.get("df") is not None:
-        if st.session_state.get("show_table", True):
-            df = st.session_state.get("df")
-            assistant_message_table = st.chat_message(
-                "assistant",
-                avatar="https://ask.vanna.ai/static/img/vanna_circle.png",
-            )
-            if len(df) > 10:
-                assistant_message_table.text("First 10 rows of data")
-                assistant_message_table.dataframe(df.head(10))
-            else:
-                assistant_message_table.dataframe(df)
-
-    if st.session_state.get("show_vegalite_json", False):
-        json_graph = generate_visualization(my_question, df)
-        assistant_message_vegalite_json = st.chat_message(
-            "assistant",
-            avatar="https://ask.vanna.ai/static/img/vanna_circle.png",
+    result = get_result(my_question)
+
+    if st.session_state.get("show_sql", True) and result["sql"] is not None:
+        assistant_message_sql = st.chat_message("assistant", avatar=AVATAR)
+        assistant_message_sql.code(
+            f"""{result["sql"]}""", language="sql", line_numbers=True
+        )
+
+    if "error" in result:
+        assistant_message_error = st.chat_message("assistant", avatar=AVATAR)
+        assistant_message_error.error(
+            f"I couldn't answer this question: {result['error']}"
+        )
+
+if my_question and "error" not in result:
+    df = result["df"]
+
+    if st.session_state.get("show_table", True):
+        assistant_message_table = st.chat_message("assistant", avatar=AVATAR)
+        if len(df) > 10:
+            assistant_message_table.text("First 10 rows of data")
+            assistant_message_table.dataframe(df.head(10))
+        else:
+            assistant_message_table.dataframe(df)
+
+    json_graph = None
+    if st.session_state.get("show_vegalite_json", True) or st.session_state.get(
+        "show_chart", True
+    ):
+        json_graph = get_stage(
+            my_question,
+            "chart",
+            lambda r: get_pipeline().generate_visualization(my_question, r["df"]),
         )
+
+    if st.session_state.get("show_vegalite_json", True):
+        assistant_message_vegalite_json = st.chat_message("assistant", avatar=AVATAR)
         assistant_message_vegalite_json.code(
-            json_graph, language="python", line_numbers=True
+            json.dumps(json_graph, indent=2), language="json", line_numbers=True
         )
 
     if st.session_state.get("show_chart", True):
-        assistant_message_chart = st.chat_message(
-            "assistant",
-            avatar="https://ask.vanna.ai/static/img/vanna_circle.png",
-        )
-        try:
-            st.vega_lite_chart(df, json_graph)
-        except:
+        assistant_message_chart = st.chat_message("assistant", avatar=AVATAR)
+        if json_graph is None:
             assistant_message_chart.error("I couldn't generate a chart")
+        else:
+            try:
+                with telemetry.span("chart_render"):
+                    assistant_message_chart.vega_lite_chart(df, json_graph)
+            except Exception as e:  # pylint: disable=broad-except
+                _LOG.warning("Failed to render chart: %s", e)
+                assistant_message_chart.error("I couldn't generate a chart")
 
     if st.session_state.get("show_followup", True):
-        assistant_message_followup = st.chat_message(
-            "assistant",
-            avatar="https://ask.vanna.ai/static/img/vanna_circle.png",
+        followup_questions = get_stage(
+            my_question,
+            "followup",
+            lambda _: get_pipeline().followup_questions_inference(
+                my_question, get_database(dataset_version(DATASET_PATH))[1]
+            ),
         )
-        followup_questions = followup_questions_inference(my_question)
-
-        st.session_state["df"] = None
-
+        assistant_message_followup = st.chat_message("assistant", avatar=AVATAR)
         if len(followup_questions) > 0:
             assistant_message_followup.text(
                 "Here are some possible follow-up questions"
             )
-            # Print the first 5 follow-up questions
-            for question in followup_questions[:5]:
-                time.sleep(0.05)
-                assistant_message_followup.write(question)
-
-    st.session_state["my_question"] = None
+            # Show the first 5 follow-up questions
+            for index, question in enumerate(followup_questions[:5]):
+                assistant_message_followup.button(
+                    question,
+                    key=f"followup_{index}",
+                    on_click=set_question,
+                    args=(question,),
+                )
+
+run_ms = 1000 * (time.perf_counter() - _SCRIPT_START)
+runs = st.session_state.setdefault("run_ms", [])
+runs.append(run_ms)
+_LOG.info("Script run %d took %.1f ms", len(runs), run_ms)
+with st.sidebar.expander("Timings"):
+    st.write(
+        {
+            "first_run_ms": round(runs[0], 1),
+            "last_run_ms": round(run_ms, 1),
+            "runs": len(runs),
+        }
+    )
+    # The pipeline is only imported once a question was asked
+    if my_question:
+        st.write(get_pipeline().chart_report())
@@ -0,0 +1,89 @@
+"""Run the offline end-to-end benchmark against a stub inference server
+
+Example:
+    python -m bsql.bench --clients 1,4,8 --latency sqlcoder=0.8 --output bench.json
+"""
+
+import argparse
+import json
+import sys
+
+from bsql.bench.questions import QUESTIONS
+from bsql.bench.runner import run_benchmark
+from bsql.bench.server import StubModels, StubServer
+
+
+def parse_latency(value: str) -> dict:
+    """Parse ``model=seconds`` pairs separated by commas"""
+    latency = {}
+    for pair in filter(None, value.split(",")):
+        name, seconds = pair.split("=")
+        latency[name.strip()] = float(seconds)
+    return latency
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="data", help="folder with the csv files")
+    parser.add_argument("--clients", default="1,4", help="comma separated client counts")
+    parser.add_argument("--repeats", type=int, default=1, help="passes over the question set")
+    parser.add_argument("--latency", default="", help="per model latency, e.g. sqlcoder=0.8")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative latency jitter")
+    parser.add_argument(
+        "--max-concurrency", type=int, default=1, help="requests the stub serves at once"
+    )
+    parser.add_argument("--recorded", help="json file of recorded model responses")
+    parser.add_argument(
+        "--api", help="benchmark a running inference server instead of the stub"
+    )
+    parser.add_argument(
+        "--result-cache",
+        action="store_true",
+        help="reuse query results across sessions, off so execute/summarize are timed",
+    )
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    questions = [item["question"] for item in QUESTIONS]
+    clients = [int(n) for n in args.clients.split(",")]
+
+    if args.api:
+        report = run_benchmark(
+            questions, args.data, args.api, clients, args.repeats, args.result_cache
+        )
+    else:
+        recorded = None
+        if args.recorded:
+            with open(args.recorded, "r", encoding="utf8") as file:
+                recorded = json.load(file)
+        models = StubModels(
+            recorded=recorded,
+            latency=parse_latency(args.latency),
+            jitter=args.jitter,
+            max_concurrency=args.max_concurrency,
+        )
+        with StubServer(models) as server:
+            report = run_benchmark(
+                questions,
+                args.data,
+                server.api,
+                clients,
+                args.repeats,
+                args.result_cache,
+            )
+        report["stub"] = {
+            "latency": models.latency,
+            "jitter": models.jitter,
+            "max_concurrency": args.max_concurrency,
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as file:
+            file.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Query throughput of concurrent sessions on shared and pooled connections
+
+``shared`` is one in-memory connection used by every session, ``pooled`` gives each
+session its own read-only connection to a WAL database. With ``--long-query`` one
+extra session keeps running a slow analytical query while the others are timed.
+
+Example:
+    python -m bsql.bench.concurrency --sessions 1,2,4,8,16,32 --long-query
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sqlite3 import connect
+from typing import List
+import argparse
+import json
+import sys
+import threading
+import time
+
+from bsql.bench.questions import QUESTIONS
+from bsql.bench.runner import latency_summary
+from bsql.pipeline import load_data
+from bsql.sql.connections import ConnectionManager
+
+# Self join producing millions of row pairs, seconds on the sample data
+LONG_QUERY = (
+    "SELECT a.departmenttype, COUNT(*) FROM employee_data a "
+    "JOIN employee_data b ON a.departmenttype = b.departmenttype "
+    "GROUP BY a.departmenttype"
+)
+
+
+class SharedConnection:
+    """A single connection handed to every session, as the app used to do"""
+
+    def __init__(self, dataset_path: str):
+        self.conn = connect(":memory:", check_same_thread=False)
+        load_data(dataset_path, self.conn)
+
+    @contextmanager
+    def reader(self):
+        yield self.conn
+
+    def close(self):
+        self.conn.close()
+
+
+def run_sessions(database, sessions: int, duration: float, long_query: bool) -> dict:
+    """Run the bench queries from concurrent sessions for ``duration`` seconds"""
+    queries = [item["sql"] for item in QUESTIONS]
+    stop = threading.Event()
+
+    def session(index: int) -> List[float]:
+        latencies = []
+        while not stop.is_set():
+            sql = queries[(index + len(latencies)) % len(queries)]
+            start = time.perf_counter()
+            with database.reader() as conn:
+                conn.execute(sql).fetchall()
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def long_session() -> int:
+        completed = 0
+        while not stop.is_set():
+            with database.reader() as conn:
+                conn.execute(LONG_QUERY).fetchall()
+            completed += 1
+        return completed
+
+    with ThreadPoolExecutor(max_workers=sessions + 1) as executor:
+        background = executor.submit(long_session) if long_query else None
+        futures = [executor.submit(session, index) for index in range(sessions)]
+        time.sleep(duration)
+        stop.set()
+        latencies = [latency for future in futures for latency in future.result()]
+        long_completed = background.result() if background else 0
+    return {
+        "sessions": sessions,
+        "queries": len(latencies),
+        "throughput_qps": len(latencies) / duration,
+        "latency": latency_summary(latencies),
+        "long_queries": long_completed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="data", help="folder with the csv files")
+    parser.add_argument("--sessions", default="1,2,4,8,16,32", help="session counts")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per run")
+    parser.add_argument("--modes", default="shared,pooled", help="connection modes")
+    parser.add_argument(
+        "--long-query", action="store_true", help="run a slow query alongside"
+    )
+    args = parser.parse_args(argv)
+
+    report = {"duration_s": args.duration, "long_query": args.long_query, "modes": {}}
+    for mode in args.modes.split(","):
+        if mode == "shared":
+            database = SharedConnection(args.data)
+        else:
+            database = ConnectionManager()
+            with database.writer() as conn:
+                load_data(args.data, conn)
+        report["modes"][mode] = [
+            run_sessions(database, int(sessions), args.duration, args.long_query)
+            for sessions in args.sessions.split(",")
+        ]
+        database.close()
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
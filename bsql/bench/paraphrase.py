@@ -0,0 +1,214 @@
+"""Hit rate versus false-hit rate of the semantic SQL cache on paraphrase sets
+
+Example:
+    python -m bsql.bench.paraphrase --thresholds 0.6,0.7,0.8,0.9
+"""
+
+from sqlite3 import connect
+from typing import List
+import argparse
+import json
+import sys
+
+from bsql.pipeline import load_data
+from bsql.sql.cache import SemanticSQLCache, SentenceEmbedder
+
+# Each set holds phrasings of one question; neighbouring sets are deliberately close
+# in wording but need different SQL, so returning their SQL is a false hit.
+PARAPHRASE_SETS = [
+    {
+        "sql": "SELECT departmenttype, COUNT(*) AS headcount FROM employee_data "
+        "GROUP BY departmenttype;",
+        "phrasings": [
+            "How many employees are in each department?",
+            "headcount by department",
+            "how many employees per dept",
+            "Number of employees in every department",
+            "Show the employee count for each department",
+        ],
+    },
+    {
+        "sql": "SELECT division, COUNT(*) AS headcount FROM employee_data "
+        "GROUP BY division;",
+        "phrasings": [
+            "How many employees are in each division?",
+            "headcount by division",
+            "number of staff per division",
+        ],
+    },
+    {
+        "sql": "SELECT education_level, AVG(desired_salary) AS average_desired_salary "
+        "FROM recruitment_data GROUP BY education_level;",
+        "phrasings": [
+            "What is the average desired salary for each education level?",
+            "average desired salary by education level",
+            "mean desired salary per education level",
+            "avg salary applicants want by education level",
+        ],
+    },
+    {
+        "sql": "SELECT education_level, MAX(desired_salary) AS max_desired_salary "
+        "FROM recruitment_data GROUP BY education_level;",
+        "phrasings": [
+            "What is the highest desired salary for each education level?",
+            "maximum desired salary by education level",
+        ],
+    },
+    {
+        "sql": "SELECT training_program_name, SUM(training_cost) AS total_training_cost "
+        "FROM training_and_development_data GROUP BY training_program_name;",
+        "phrasings": [
+            "What is the total training cost for each training program?",
+            "total training cost by program",
+            "sum of training costs per training program",
+        ],
+    },
+    {
+        "sql": "SELECT training_program_name, AVG(training_cost) AS average_training_cost "
+        "FROM training_and_development_data GROUP BY training_program_name;",
+        "phrasings": [
+            "What is the average training cost for each training program?",
+            "mean training cost by program",
+        ],
+    },
+    {
+        "sql": "SELECT status, COUNT(*) AS applicants FROM recruitment_data "
+        "GROUP BY status;",
+        "phrasings": [
+            "How many applicants are in each application status?",
+            "number of applicants by status",
+            "applicant count per recruitment status",
+        ],
+    },
+]
+
+# Questions whose SQL is never cached, any hit on them is a false hit
+UNSEEN = [
+    "How many employees are in each state?",
+    "headcount by gender",
+    "What is the average engagement score by department?",
+    "total training cost by location",
+    "highest desired salary by job title",
+    "How many applicants applied for each job title?",
+]
+
+# Seeded questions with an added filter, year, number or negation; they are close
+# in wording to a seeded phrasing but need different SQL, any hit is a false hit
+FILTERED = [
+    "How many active employees are in each department?",
+    "How many employees are not in each department?",
+    "How many employees left each department?",
+    "headcount by department for women",
+    "headcount by department in 2020",
+    "How many employees are in each division excluding contractors?",
+    "average desired salary by education level in 2020",
+    "average desired salary by education level for applicants under 30",
+    "What is the highest desired salary for each education level without a degree?",
+    "total training cost by program above 1000",
+    "What is the total training cost for each training program in 2022?",
+    "number of applicants by status excluding rejected",
+    "number of female applicants by status",
+]
+
+
+# Questions close to a seeded phrasing but with another aggregation or an extra
+# grouping column, paired with the SQL that answers them when it was seeded; any
+# other hit is a false hit
+_TRAINING_TOTAL = PARAPHRASE_SETS[4]["sql"]
+CONTRAST = [
+    ("minimum desired salary by education level", None),
+    ("lowest desired salary for each education level", None),
+    ("average desired salary by education level and gender", None),
+    ("total training cost by training program name", _TRAINING_TOTAL),
+    ("maximum training cost by program", None),
+    ("average training cost by training program and trainer", None),
+    ("How many employees are in each department by gender?", None),
+    ("How many employees are in each department and division?", None),
+    ("headcount by division and state", None),
+    ("number of applicants by status and education level", None),
+    ("average number of applicants by status", None),
+]
+
+
+def evaluate(cache_factory, conn, schema: str) -> dict:
+    """Seed a cache with the first phrasing of each set and query the rest
+
+    Returns:
+        Hit rate (paraphrases answered with their own SQL), false-hit rate
+        (paraphrases answered with another set's SQL, unseen or filtered questions
+        that hit and contrast questions answered with the wrong SQL) and the
+        false-hit rates on the filtered and contrast questions alone. The
+        paraphrases lean on the hand-written ``SYNONYMS``, so the hit rate is
+        optimistic for wording they do not cover.
+    """
+    cache = cache_factory()
+    for paraphrases in PARAPHRASE_SETS:
+        cache.add(paraphrases["phrasings"][0], schema, paraphrases["sql"])
+
+    queries = hits = false_hits = 0
+    for paraphrases in PARAPHRASE_SETS:
+        for phrasing in paraphrases["phrasings"][1:]:
+            queries += 1
+            sql = cache.lookup(phrasing, schema, conn)
+            if sql == paraphrases["sql"]:
+                hits += 1
+            elif sql is not None:
+                false_hits += 1
+    paraphrases_asked = queries
+    for question in UNSEEN:
+        queries += 1
+        false_hits += cache.lookup(question, schema, conn) is not None
+    filtered_hits = 0
+    for question in FILTERED:
+        queries += 1
+        filtered_hits += cache.lookup(question, schema, conn) is not None
+    contrast_hits = 0
+    for question, expected in CONTRAST:
+        queries += 1
+        sql = cache.lookup(question, schema, conn)
+        contrast_hits += sql is not None and sql != expected
+    return {
+        "queries": queries,
+        "hit_rate": hits / paraphrases_asked,
+        "false_hit_rate": (false_hits + filtered_hits + contrast_hits) / queries,
+        "filtered_false_hit_rate": filtered_hits / len(FILTERED),
+        "contrast_false_hit_rate": contrast_hits / len(CONTRAST),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="data", help="folder with the csv files")
+    parser.add_argument(
+        "--thresholds", default="0.5,0.6,0.7,0.8,0.85,0.9,0.95", help="similarities"
+    )
+    parser.add_argument(
+        "--sentence-model",
+        help="use this sentence-transformers model instead of the hashing embedder",
+    )
+    args = parser.parse_args(argv)
+
+    conn = connect(":memory:")
+    schema = load_data(args.data, conn)
+    embedder = SentenceEmbedder(args.sentence_model) if args.sentence_model else None
+    thresholds: List[float] = [float(t) for t in args.thresholds.split(",")]
+
+    report = {
+        "embedder": args.sentence_model or "hashing",
+        "results": [
+            {
+                "threshold": threshold,
+                **evaluate(
+                    lambda t=threshold: SemanticSQLCache(embedder=embedder, threshold=t),
+                    conn,
+                    schema,
+                ),
+            }
+            for threshold in thresholds
+        ],
+    }
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
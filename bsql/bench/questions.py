@@ -0,0 +1,65 @@
+"""Benchmark question set for the bundled HR datasets"""
+
+QUESTIONS = [
+    {
+        "question": "How many employees are in each department?",
+        "sql": "SELECT departmenttype, COUNT(*) AS headcount FROM employee_data "
+        "GROUP BY departmenttype ORDER BY headcount DESC;",
+    },
+    {
+        "question": "What is the distribution of current employee ratings?",
+        "sql": "SELECT current_employee_rating FROM employee_data;",
+    },
+    {
+        "question": "What is the average desired salary for each education level?",
+        "sql": "SELECT education_level, AVG(desired_salary) AS average_desired_salary "
+        "FROM recruitment_data GROUP BY education_level;",
+    },
+    {
+        "question": "What is the total training cost for each training program?",
+        "sql": "SELECT training_program_name, SUM(training_cost) AS total_training_cost "
+        "FROM training_and_development_data GROUP BY training_program_name "
+        "ORDER BY total_training_cost DESC;",
+    },
+    {
+        "question": "How many applicants are in each application status?",
+        "sql": "SELECT status, COUNT(*) AS applicants FROM recruitment_data GROUP BY status;",
+    },
+    {
+        "question": "What is the average engagement score in each department?",
+        "sql": "SELECT e.departmenttype, AVG(s.engagement_score) AS average_engagement_score "
+        "FROM employee_data e JOIN employee_engagement_survey_data s "
+        "ON s.employee_id = e.empid GROUP BY e.departmenttype;",
+    },
+    {
+        "question": "Which trainers ran the most training sessions?",
+        "sql": "SELECT trainer, COUNT(*) AS sessions FROM training_and_development_data "
+        "GROUP BY trainer ORDER BY sessions DESC LIMIT 10;",
+    },
+    {
+        "question": "What are the names and job titles of active employees in the IT department?",
+        "sql": "SELECT firstname, lastname, title FROM employee_data "
+        "WHERE departmenttype LIKE 'IT/IS%' AND employeestatus = 'Active' "
+        "ORDER BY firstname, lastname;",
+    },
+    {
+        "question": "How many training sessions ended with each outcome?",
+        "sql": "SELECT training_outcome FROM training_and_development_data;",
+    },
+    {
+        "question": "How many employees were hired each year?",
+        "sql": "SELECT '20' || substr(startdate, -2) AS hire_year, COUNT(*) AS hires "
+        "FROM employee_data GROUP BY hire_year ORDER BY hire_year;",
+    },
+    {
+        "question": "What are the desired salaries of applicants?",
+        "sql": "SELECT desired_salary FROM recruitment_data;",
+    },
+    {
+        "question": "What is the average satisfaction and engagement score per employee type?",
+        "sql": "SELECT e.employeetype, AVG(s.satisfaction_score) AS average_satisfaction, "
+        "AVG(s.engagement_score) AS average_engagement FROM employee_data e "
+        "JOIN employee_engagement_survey_data s ON s.employee_id = e.empid "
+        "GROUP BY e.employeetype;",
+    },
+]
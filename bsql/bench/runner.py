@@ -0,0 +1,156 @@
+"""Headless end-to-end benchmark of the question to chart pipeline"""
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlite3 import connect
+from typing import Dict, List
+import math
+import resource
+import time
+
+from bsql import telemetry
+from bsql.pipeline import (
+    execute_sql,
+    followup_questions_inference,
+    generate_sql,
+    generate_visualization,
+    load_data,
+    result_cache,
+    summarize,
+)
+
+STAGES = ["sql", "execute", "summarize", "chart", "followup"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of the values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def latency_summary(values: List[float]) -> dict:
+    """p50/p95/p99 and mean of latencies given in seconds, reported in ms"""
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+    }
+
+
+def peak_memory_mb() -> float:
+    """Peak resident set size of this process"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_session(question: str, conn, schema: str, api: str) -> Dict[str, float]:
+    """Run one question through every stage of the app
+
+    Returns:
+        Latency in seconds per stage.
+    """
+    timings = {}
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    with telemetry.trace():
+        sql = timed("sql", generate_sql, question, schema, api)
+        df = timed("execute", execute_sql, sql, conn)
+        timed("summarize", summarize, df, sql)
+        timed("chart", generate_visualization, question, df, api)
+        timed("followup", followup_questions_inference, question, schema, api)
+    return timings
+
+
+def run_clients(
+    questions: List[str],
+    dataset_path: str,
+    api: str,
+    clients: int,
+    repeats: int = 1,
+    use_result_cache: bool = False,
+) -> dict:
+    """Run the question set from concurrent clients
+
+    Every client owns a connection to its own copy of the data, loaded before the
+    clock starts, and asks every question ``repeats`` times. The process wide
+    result cache is shared by the clients, so it is cleared before each run and
+    disabled unless ``use_result_cache``; otherwise ``execute`` and ``summarize``
+    mostly time cache hits.
+
+    Returns:
+        Throughput, error count and per-stage latency percentiles.
+    """
+    connections = []
+    for _ in range(clients):
+        conn = connect(":memory:", check_same_thread=False)
+        connections.append((conn, load_data(dataset_path, conn)))
+
+    def client(index: int):
+        conn, schema = connections[index]
+        results, errors = [], []
+        for _ in range(repeats):
+            for question in questions:
+                start = time.perf_counter()
+                try:
+                    timings = run_session(question, conn, schema, api)
+                except Exception as e:  # pylint: disable=broad-except
+                    errors.append(f"{question}: {e}")
+                    continue
+                timings["end_to_end"] = time.perf_counter() - start
+                results.append(timings)
+        return results, errors
+
+    result_cache.enabled = use_result_cache
+    result_cache.clear()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        outcomes = list(executor.map(client, range(clients)))
+    wall = time.perf_counter() - start
+
+    results = [timings for outcome in outcomes for timings in outcome[0]]
+    errors = [error for outcome in outcomes for error in outcome[1]]
+    for conn, _ in connections:
+        conn.close()
+    return {
+        "clients": clients,
+        "sessions": len(results),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_s": wall,
+        "throughput_qps": len(results) / wall if wall else 0.0,
+        "result_cache": result_cache.report(),
+        "stages": {
+            stage: latency_summary([r[stage] for r in results if stage in r])
+            for stage in STAGES + ["end_to_end"]
+        },
+    }
+
+
+def run_benchmark(
+    questions: List[str],
+    dataset_path: str,
+    api: str,
+    clients: List[int],
+    repeats: int = 1,
+    use_result_cache: bool = False,
+) -> dict:
+    """Run the question set for each client count and collect a JSON report"""
+    runs = [
+        run_clients(questions, dataset_path, api, n, repeats, use_result_cache)
+        for n in clients
+    ]
+    return {
+        "questions": len(questions),
+        "repeats": repeats,
+        "result_cache": use_result_cache,
+        "runs": runs,
+        "peak_memory_mb": peak_memory_mb(),
+    }
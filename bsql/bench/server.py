@@ -0,0 +1,151 @@
+"""Stub inference server replaying recorded or templated model responses"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+import json
+import random
+import threading
+import time
+
+from bsql.bench.questions import QUESTIONS
+
+DEFAULT_LATENCY = {"sqlcoder": 0.8, "data2viz": 0.6, "followup": 0.5}
+FALLBACK_SQL = "SELECT * FROM employee_data LIMIT 10;"
+
+
+class StubModels:
+    """Responses of the three models served by ``models.py``
+
+    Recorded responses take precedence; anything not recorded is answered from
+    templates built on the benchmark question set.
+
+    Args:
+        recorded: list of ``{"model_name", "question", "response"}`` records.
+        latency: mean latency in seconds per model name.
+        jitter: relative uniform jitter applied to the latency.
+        max_concurrency: number of requests served at once, 1 models a single GPU.
+    """
+
+    def __init__(
+        self,
+        recorded: Optional[List[dict]] = None,
+        latency: Optional[Dict[str, float]] = None,
+        jitter: float = 0.1,
+        max_concurrency: int = 1,
+        seed: int = 0,
+    ):
+        self.recorded = {
+            (record["model_name"], record["question"]): record["response"]
+            for record in recorded or []
+        }
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.jitter = jitter
+        self.slots = threading.Semaphore(max_concurrency)
+        self.random = random.Random(seed)
+        self.sql = {item["question"]: item["sql"] for item in QUESTIONS}
+
+    def _sqlcoder(self, request: dict):
+        return self.sql.get(request.get("question", ""), FALLBACK_SQL)
+
+    def _data2viz(self, request: dict):
+        try:
+            records = json.loads(request.get("query_result") or "[]")
+        except json.JSONDecodeError:
+            records = []
+        fields = list(records[0]) if records else ["x", "y"]
+        x_field, y_field = fields[0], fields[-1]
+        # Near-JSON like the real model: trailing comma and no closing braces
+        return (
+            "Here is the Vega-Lite json:\n"
+            f'{{"title": {json.dumps(request.get("question", ""))}, "mark": "bar", '
+            f'"encoding": {{"x": {{"field": "{x_field}", "type": "nominal"}}, '
+            f'"y": {{"field": "{y_field}", "type": "quantitative"}},'
+        )
+
+    def _followup(self, request: dict):
+        others = [
+            item["question"]
+            for item in QUESTIONS
+            if item["question"] != request.get("question")
+        ]
+        return self.random.sample(others, 3)
+
+    def respond(self, request: dict):
+        """Answer an inference request after the configured latency"""
+        model_name = request.get("model_name", "sqlcoder")
+        question = request.get("question", "")
+        handler = {
+            "sqlcoder": self._sqlcoder,
+            "data2viz": self._data2viz,
+            "followup": self._followup,
+        }.get(model_name)
+        if handler is None:
+            return "Model not found"
+
+        with self.slots:
+            jitter = self.random.uniform(-self.jitter, self.jitter)
+            time.sleep(max(self.latency.get(model_name, 0.0) * (1 + jitter), 0))
+        if (model_name, question) in self.recorded:
+            return self.recorded[(model_name, question)]
+        return handler(request)
+
+
+def _handler(models: StubModels):
+    class Handler(BaseHTTPRequestHandler):
+        """Serve ``/inference`` and ``/test`` like ``models.py``"""
+
+        def _send(self, payload, status: int = 200):
+            body = json.dumps(payload).encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path == "/test":
+                self._send("Hello from Text to SQL Server")
+            else:
+                self._send("Not found", 404)
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            if self.path != "/inference":
+                self._send("Not found", 404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            self._send(models.respond(request))
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
+
+
+class StubServer:
+    """Stub inference server running in a background thread
+
+    Args:
+        models: the stub models to serve.
+        host: interface to bind.
+        port: port to bind, 0 picks a free port.
+    """
+
+    def __init__(self, models: StubModels, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), _handler(models))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def api(self) -> str:
+        """URL of the inference endpoint"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/inference"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,70 @@
+"""Compare greedy and assisted SQLCoder decoding
+
+Checks that every assisted mode returns exactly the greedy output and reports
+tokens/sec, tokens per forward pass and the draft acceptance rate.
+
+Example:
+    python -m bsql.bench.speculative --model defog/sqlcoder-7b-2 --device cuda
+    python -m bsql.bench.speculative --tiny
+"""
+
+from sqlite3 import connect
+import argparse
+import json
+import sys
+import tempfile
+
+from bsql.bench import tiny_model
+from bsql.bench.questions import QUESTIONS
+from bsql.pipeline import load_data
+from bsql.sql.sqlcoder import SQLCoder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="defog/sqlcoder-7b-2", help="target model")
+    parser.add_argument("--draft-model", help="draft model sharing the tokenizer")
+    parser.add_argument("--device", default="cuda", help="cuda or cpu")
+    parser.add_argument("--num-assistant-tokens", type=int, default=10)
+    parser.add_argument("--questions", type=int, default=len(QUESTIONS))
+    parser.add_argument("--data", default="data", help="folder with the csv files")
+    parser.add_argument(
+        "--tiny",
+        action="store_true",
+        help="build tiny random target and draft models and run them on cpu",
+    )
+    args = parser.parse_args(argv)
+
+    if args.tiny:
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        args.model, args.draft_model = tiny_model.build(directory.name, args.data)
+        args.device = "cpu"
+
+    schema = load_data(args.data, connect(":memory:"))
+    questions = [item["question"] for item in QUESTIONS[: args.questions]]
+    coder = SQLCoder(
+        model_name=args.model,
+        draft_model_name=args.draft_model,
+        num_assistant_tokens=args.num_assistant_tokens,
+        device=args.device,
+    )
+    coder.load_model()
+
+    modes = [None, "prompt_lookup"] + (["draft"] if args.draft_model else [])
+    outputs, reports = {}, []
+    for mode in modes:
+        coder.assisted = mode
+        coder.stats = dict.fromkeys(coder.stats, 0)
+        coder.stats["seconds"] = 0.0
+        outputs[mode] = [coder.inference(question, schema) for question in questions]
+        report = coder.report()
+        report["identical_to_greedy"] = outputs[mode] == outputs[None]
+        reports.append(report)
+
+    sys.stdout.write(json.dumps(reports, indent=2) + "\n")
+    if not all(report["identical_to_greedy"] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
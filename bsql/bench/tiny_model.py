@@ -0,0 +1,89 @@
+"""Tiny randomly initialized SQLCoder stand-ins for testing on CPU
+
+Builds a two layer target and a one layer draft Llama sharing a small BPE tokenizer
+trained on the bench questions and the sample data. Their output is meaningless but
+decoding runs in seconds, enough to check that assisted decoding matches greedy.
+
+Example:
+    python -m bsql.bench.tiny_model /tmp/tiny
+    python -m bsql.bench.speculative --tiny
+"""
+
+from typing import Tuple
+import argparse
+import glob
+import os
+import sys
+
+import torch
+
+from bsql.bench import questions
+
+
+def build(path: str, data: str = "data") -> Tuple[str, str]:
+    """Save the tiny target and draft models under ``path``
+
+    Returns:
+        The target and draft model directories.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    with open(questions.__file__, encoding="utf8") as file:
+        texts = [file.read()] * 3
+    for csv in glob.glob(os.path.join(data, "*.csv")):
+        with open(csv, encoding="utf8", errors="ignore") as file:
+            texts.append(file.read(200_000))
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        texts,
+        trainers.BpeTrainer(
+            vocab_size=1000,
+            special_tokens=["<unk>", "<s>", "</s>"],
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        ),
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token="<unk>",
+        bos_token="<s>",
+        eos_token="</s>",
+    )
+
+    directories = []
+    for name, layers, seed in [("target", 2, 0), ("draft", 1, 1)]:
+        torch.manual_seed(seed)
+        config = LlamaConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=64,
+            intermediate_size=128,
+            num_hidden_layers=layers,
+            num_attention_heads=4,
+            num_key_value_heads=4,
+            max_position_embeddings=8192,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+        directory = os.path.join(path, name)
+        LlamaForCausalLM(config).save_pretrained(directory)
+        tokenizer.save_pretrained(directory)
+        directories.append(directory)
+    return directories[0], directories[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="directory to save the models in")
+    parser.add_argument("--data", default="data", help="folder with the csv files")
+    args = parser.parse_args(argv)
+
+    target, draft = build(args.path, args.data)
+    sys.stdout.write(f"{target}\n{draft}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,149 @@
 """Abstract implementation for models"""
 from abc import ABC, abstractmethod
+from typing import List, Optional
+import os
+import threading
+import time
 
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from bsql import telemetry
+
+# device_map="auto" sizes a placement from the GPU memory free when a load starts,
+# so concurrent loads would each plan for the whole GPU
+_PLACEMENT_LOCK = threading.Lock()
 
-class Model(ABC):
-    """Abstract class for models"""
+
+class _FirstTokenTimer(StoppingCriteria):
+    """Record when the first token is out, which ends the prefill"""
 
     def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.first_token_at is None:
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            self.first_token_at = time.perf_counter()
+        return False
+
+
+def snapshot_path(bin_dir: str, model_name: str) -> str:
+    """Local directory of the prepared snapshot of a model"""
+    return os.path.join(bin_dir, model_name.replace("/", "--"))
+
+
+def find_snapshot(bin_dir: Optional[str], model_name: str) -> Optional[str]:
+    """Prepared snapshot of a model, None when it was not prepared"""
+    if not bin_dir:
+        return None
+    path = snapshot_path(bin_dir, model_name)
+    return path if os.path.exists(os.path.join(path, "config.json")) else None
+
+
+class Model(ABC):
+    """Abstract class for models
+
+    ``model`` is the transformers model. When ``snapshot_dir`` is set, weights and
+    tokenizer are loaded from a snapshot written by ``save_snapshot`` (see
+    ``python -m bsql.prepare``) instead of the hub, memory mapping the already
+    converted safetensors. Models are placed on the device one at a time; snapshots
+    can be read ahead in parallel with ``read_snapshot``.
+    """
+
+    def __init__(self, snapshot_dir: Optional[str] = None):
         self.is_loaded = False
         self.model = None
         self.tokenizer = None
+        self.snapshot_dir = snapshot_dir
+        self._load_lock = threading.Lock()
+
+    @property
+    def source(self) -> str:
+        """Snapshot directory if there is one, else the hub model name"""
+        return self.snapshot_dir or self.model_name
+
+    @property
+    def snapshot_dirs(self) -> List[str]:
+        """Prepared snapshots this model loads from"""
+        return [self.snapshot_dir] if self.snapshot_dir else []
+
+    def read_snapshot(self, chunk_size: int = 64 * 2**20) -> int:
+        """Read the snapshot files into the page cache, returns the bytes read
+
+        Safe to run concurrently with other models' loads, ``load_model`` then
+        memory maps the weights without waiting on the disk.
+        """
+        read = 0
+        for directory in self.snapshot_dirs:
+            for name in sorted(os.listdir(directory)):
+                with open(os.path.join(directory, name), "rb") as file:
+                    for chunk in iter(lambda file=file: file.read(chunk_size), b""):
+                        read += len(chunk)
+        return read
 
     def load_model(self):
-        """Load model weights"""
-        if not self.is_loaded:
-            self._load_model()
-            self.is_loaded = True
+        """Load model weights, one model at a time across all models"""
+        with self._load_lock:
+            if not self.is_loaded:
+                with _PLACEMENT_LOCK:
+                    self._load_model()
+                self.is_loaded = True
+
+    def save_snapshot(self, path: str):
+        """Save the loaded (and quantized) weights and tokenizer as safetensors"""
+        self.load_model()
+        self.model.save_pretrained(path, safe_serialization=True)
+        self.tokenizer.save_pretrained(path)
+
+    def warmup(self, prompt: str = "SELECT", max_new_tokens: int = 8):
+        """Run a short synthetic generate
+
+        The first generate pays for kernel selection, CUDA context and allocator
+        growth; doing it here keeps that cost off the first request.
+        """
+        self.load_model()
+        with telemetry.span("warmup"):
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+            with torch.inference_mode():
+                self.model.generate(
+                    input_ids=inputs["input_ids"],
+                    attention_mask=inputs["attention_mask"],
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                )
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+
+    def generate(self, input_ids, **kwargs):
+        """Run ``model.generate`` recording prefill and decode spans and tokens/sec"""
+        if not telemetry.ENABLED:
+            return self.model.generate(input_ids, **kwargs)
+
+        timer = _FirstTokenTimer()
+        criteria = StoppingCriteriaList(kwargs.pop("stopping_criteria", None) or [])
+        criteria.append(timer)
+        start = time.perf_counter()
+        generated_ids = self.model.generate(
+            input_ids, stopping_criteria=criteria, **kwargs
+        )
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        end = time.perf_counter()
+
+        model = type(self).__name__
+        first_token_at = timer.first_token_at or end
+        new_tokens = generated_ids.shape[-1] - input_ids.shape[-1]
+        telemetry.record_span("prefill", first_token_at - start)
+        telemetry.record_span("decode", end - first_token_at)
+        telemetry.GENERATED_TOKENS.inc(new_tokens, model=model)
+        if new_tokens > 1 and end > first_token_at:
+            telemetry.TOKENS_PER_SECOND.observe(
+                (new_tokens - 1) / (end - first_token_at), model=model
+            )
+        return generated_ids
 
     @abstractmethod
     def _load_model(self):
@@ -0,0 +1,201 @@
+"""Question to SQL to chart pipeline shared by the app and the benchmarks"""
+
+from typing import List
+import os
+import logging
+import time
+import json
+
+import pandas as pd
+import requests
+import sqlparse
+
+from bsql import telemetry
+from bsql.sql.cache import SemanticSQLCache
+from bsql.sql.result_cache import ResultCache
+from bsql.viz.recommender import ChartRecommender
+from bsql.viz.spec import SpecProcessor
+from bsql.viz.summarizer import Summarizer
+
+MAX_UNIQUE = 5
+API = "http://127.0.0.1:8000/inference"
+MAX_CHART_ATTEMPTS = 2
+SQL_CACHE_PATH = os.environ.get("BSQL_SQL_CACHE", ".cache/sql_cache.npz")
+RESULT_CACHE_MB = int(os.environ.get("BSQL_RESULT_CACHE_MB", "256"))
+
+_LOG = logging.getLogger(__name__)
+_LOG.setLevel(logging.INFO)
+
+recommender = ChartRecommender()
+spec_processor = SpecProcessor()
+sql_cache = SemanticSQLCache(SQL_CACHE_PATH)
+result_cache = ResultCache(RESULT_CACHE_MB * 2**20)
+# Keep-alive connections to the model server, shared by every caller
+session = requests.Session()
+
+
+def load_data(dataset_path: str, conn, with_samples=True) -> str:
+    """Load dataset from data folder
+
+    Args:
+        dataset_path (str): path to data folder with files in .csv
+        is_unique (bool, optional): whether to include sample values. Defaults to True.
+
+    Returns:
+        str: schema
+    """
+    with telemetry.span("schema_build"):
+        # TODO: Add adaptors for different datasets
+        files = os.listdir(dataset_path)
+
+        def snake_case(string: str) -> str:
+            """Convert string to snake case"""
+            return string.lower().replace(" ", "_")
+
+        table_to_df = {}
+
+        for file in files:
+            if not file.endswith("csv"):
+                continue
+            file_path = os.path.join(dataset_path, file)
+            df = pd.read_csv(file_path)
+            df.columns = map(snake_case, df.columns)
+
+            file = file.split(".")[0]
+            df.to_sql(file, conn, if_exists="replace", index=False)
+            result_cache.invalidate_table(file)
+            table_to_df[file] = df
+
+        schema_raw = conn.execute("SELECT * FROM sqlite_master").fetchall()
+        new_schema = ""
+        old_schema = ""
+        for table in schema_raw:
+            table_name = table[1]
+            df = table_to_df[table_name]
+            old_schema += f"{table[-1]}\n\n"
+            rows = table[-1].split("\n")
+            for index, row in enumerate(rows):
+                new_schema += row
+                col = df.columns
+                if index in [0, len(rows) - 1]:
+                    new_schema += "\n" if index == 0 else "\n\n"
+                    continue
+                uniques = df[col[index - 1]].unique().tolist()
+                to_add_str = ", ".join(
+                    [str(uniques[i]) for i in range(min(len(uniques), MAX_UNIQUE))]
+                )
+
+                new_schema += f"-- Sample values like: [{to_add_str}]\n"
+        return new_schema if with_samples else old_schema
+
+
+def post(data: dict, api: str = API) -> str:
+    """Post data to API"""
+    response = session.post(
+        api,
+        json=data,
+        headers={"Content-Type": "application/json", **telemetry.headers()},
+        timeout=5000,
+    )
+    return response.json()
+
+
+def sqlcoder_inference(question: str, schema: str, api: str = API) -> str:
+    """Get SQL query from SQLCoder model"""
+    data = {"question": question, "schema": schema, "model_name": "sqlcoder"}
+    response = post(data, api)
+    return response
+
+
+def llama_inference(query_result: str, api: str = API) -> str:
+    """Get data insights from llama"""
+    data = {"prompt": query_result, "model_name": "data2viz"}
+    response = post(data, api)
+    return response
+
+
+def vegalite_inference(question: str, query_result: str, api: str = API) -> str:
+    """Get vegalite json"""
+    data = {
+        "question": question,
+        "query_result": query_result,
+        "model_name": "data2viz",
+    }
+    response = post(data, api)
+    return response
+
+
+def followup_questions_inference(
+    question: str, schema: str = "", api: str = API
+) -> List[str]:
+    """Get follow-up questions, the server prefetches their SQL when given the schema"""
+    data = {"question": question, "schema": schema, "model_name": "followup"}
+    response = post(data, api)
+    return response
+
+
+def generate_sql(question: str, schema: str, api: str = API, conn=None) -> str:
+    """Generate and format the SQL query answering the question
+
+    When a connection is given, SQL cached for a similar past question is reused
+    instead of generating, provided it still passes ``EXPLAIN`` on the connection.
+    """
+    if conn is not None:
+        sql = sql_cache.lookup(question, schema, conn)
+        if sql is not None:
+            return sql
+    sql = sqlcoder_inference(question, schema, api)
+    return sqlparse.format(sql, reindent=True)
+
+
+def execute_sql(sql: str, conn) -> pd.DataFrame:
+    """Run the query against the database, reusing the result of identical SQL"""
+    with telemetry.span("sql_execution"):
+        df = result_cache.get(sql)
+        if df is None:
+            df = pd.read_sql(sql, conn)
+            result_cache.put(sql, df)
+        return df
+
+
+def summarize(df: pd.DataFrame, sql: str = None) -> str:
+    """Summarize the query result, cached alongside the result of ``sql`` if given"""
+    summary = result_cache.get_summary(sql) if sql else None
+    if summary is not None:
+        return summary
+    with telemetry.span("summarization"):
+        summary, _ = Summarizer().summarize(df)
+    if sql:
+        result_cache.put_summary(sql, summary)
+    return summary
+
+
+def chart_report() -> dict:
+    """Chart recommender and post-processing stats, exported as telemetry gauges"""
+    report = recommender.report()
+    for stat, value in report.items():
+        telemetry.CHART_RECOMMENDER.set(value, stat=stat)
+    return {"recommender": report, "post_processing": spec_processor.report()}
+
+
+def generate_visualization(question: str, df: pd.DataFrame, api: str = API) -> dict:
+    """Generate visualization, only falling back to the LLM for ambiguous results"""
+    spec = recommender.recommend(df, question)
+    telemetry.record_cache("chart_recommender", spec is not None)
+    if spec is not None:
+        _LOG.info("Chart recommender hit: %s", chart_report()["recommender"])
+        return spec
+
+    data_header = json.dumps(df.head().to_dict(orient="records"))
+    for _ in range(MAX_CHART_ATTEMPTS):
+        start = time.perf_counter()
+        code = vegalite_inference(question, data_header, api)
+        recommender.record_llm_latency(time.perf_counter() - start)
+        # Only regenerate when the spec cannot be repaired
+        spec = spec_processor.process(code, df)
+        if spec is not None:
+            break
+    report = chart_report()
+    _LOG.info("Chart recommender miss: %s", report["recommender"])
+    _LOG.info("Vega-Lite post-processing: %s", report["post_processing"])
+    return spec
@@ -0,0 +1,204 @@
+"""Low priority prefetch of SQL for suggested follow-up questions"""
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+import hashlib
+import logging
+import threading
+import time
+
+from bsql import telemetry
+
+_LOG = logging.getLogger(__name__)
+
+
+class PriorityGate:
+    """Exclusive access to the GPU where interactive requests always go first
+
+    Background work only starts when no interactive request is running or waiting,
+    and checks ``preempted`` to stop as soon as one arrives.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._interactive = 0
+        self._busy = False
+
+    @property
+    def preempted(self) -> bool:
+        """Whether an interactive request is running or waiting"""
+        return self._interactive > 0
+
+    @contextmanager
+    def interactive(self):
+        """Run an interactive request"""
+        with self._condition:
+            self._interactive += 1
+            telemetry.QUEUE_DEPTH.inc()
+            self._condition.wait_for(lambda: not self._busy)
+            self._busy = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy = False
+                self._interactive -= 1
+                telemetry.QUEUE_DEPTH.dec()
+                self._condition.notify_all()
+
+    @contextmanager
+    def background(self):
+        """Run background work once the gate is idle"""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._busy and not self._interactive)
+            self._busy = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+
+class Preemption:
+    """Stopping criterion ending a background generation when the gate is wanted"""
+
+    def __init__(self, gate: PriorityGate):
+        self.gate = gate
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        self.triggered = self.triggered or self.gate.preempted
+        return self.triggered
+
+
+def _key(question: str, schema: str) -> tuple:
+    return question.strip().lower(), hashlib.sha1(schema.encode("utf8")).hexdigest()
+
+
+class Prefetcher:
+    """Generate SQL for suggested follow-up questions on idle capacity
+
+    Args:
+        gate: gate shared with the interactive requests.
+        generate: ``generate(question, schema, stopping_criteria)`` returning SQL.
+        max_entries: size of the cache of prefetched SQL.
+        max_pending: size of the queue of questions to prefetch, oldest dropped.
+        max_attempts: times a preempted question is retried.
+    """
+
+    def __init__(
+        self,
+        gate: PriorityGate,
+        generate: Callable[[str, str, list], str],
+        max_entries: int = 64,
+        max_pending: int = 16,
+        max_attempts: int = 3,
+    ):
+        self.gate = gate
+        self.generate = generate
+        self.max_entries = max_entries
+        self.max_attempts = max_attempts
+        self.pending = deque(maxlen=max_pending)
+        self.cache = OrderedDict()
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "preempted": 0,
+            "hits": 0,
+            "misses": 0,
+            "evicted_unused": 0,
+            "compute_seconds": 0.0,
+            "wasted_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+        self._work = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, questions: List[str], schema: str):
+        """Queue follow-up questions for prefetching"""
+        with self._lock:
+            queued = {_key(question, schema) for question, _, _ in self.pending}
+            for question in questions:
+                key = _key(question, schema)
+                if key in self.cache or key in queued:
+                    continue
+                self.pending.append((question, schema, 0))
+                queued.add(key)
+                self.stats["submitted"] += 1
+        self._work.set()
+
+    def get(self, question: str, schema: str) -> Optional[str]:
+        """Take the prefetched SQL of a question, if any"""
+        with self._lock:
+            entry = self.cache.pop(_key(question, schema), None)
+            self.stats["hits" if entry else "misses"] += 1
+        telemetry.record_cache("prefetch", entry is not None)
+        return entry["sql"] if entry else None
+
+    def _store(self, question: str, schema: str, sql: str, seconds: float):
+        with self._lock:
+            self.cache[_key(question, schema)] = {"sql": sql, "seconds": seconds}
+            self.stats["completed"] += 1
+            self.stats["compute_seconds"] += seconds
+            while len(self.cache) > self.max_entries:
+                _, evicted = self.cache.popitem(last=False)
+                self.stats["evicted_unused"] += 1
+                self.stats["wasted_seconds"] += evicted["seconds"]
+
+    def _next(self):
+        with self._lock:
+            if self.pending:
+                return self.pending.popleft()
+            self._work.clear()
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                self._work.wait()
+                continue
+            question, schema, attempts = job
+            with self.gate.background():
+                preemption = Preemption(self.gate)
+                start = time.perf_counter()
+                try:
+                    sql = self.generate(question, schema, [preemption])
+                except Exception:  # pylint: disable=broad-except
+                    _LOG.exception("Prefetch of %r failed", question)
+                    continue
+                seconds = time.perf_counter() - start
+
+            if not preemption.triggered:
+                self._store(question, schema, sql, seconds)
+                continue
+            with self._lock:
+                self.stats["preempted"] += 1
+                self.stats["compute_seconds"] += seconds
+                self.stats["wasted_seconds"] += seconds
+                if attempts + 1 < self.max_attempts:
+                    self.pending.appendleft((question, schema, attempts + 1))
+
+    def report(self) -> dict:
+        """Prefetch hit rate and wasted compute
+
+        ``hit_rate`` is the share of completed prefetches a request used.
+        ``lookup_hit_rate`` divides by every SQLCoder request instead, most of which
+        are new questions that were never prefetched.
+        """
+        with self._lock:
+            stats = dict(self.stats, cached=len(self.cache), pending=len(self.pending))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            stats["hits"] / stats["completed"] if stats["completed"] else 0.0
+        )
+        stats["lookup_hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["wasted_fraction"] = (
+            stats["wasted_seconds"] / stats["compute_seconds"]
+            if stats["compute_seconds"]
+            else 0.0
+        )
+        return stats
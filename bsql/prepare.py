@@ -0,0 +1,127 @@
+"""Prepare local model snapshots for a fast server start
+
+Loads every model once from the hub (quantizing VegaLite to 4-bit on the way) and
+saves weights and tokenizer as safetensors under ``MODEL_BIN_DIR_T2SQL`` and
+``MODEL_BIN_DIR_D2V``. ``models.py`` then loads those snapshots memory mapped, with
+no download or quantization.
+
+Example:
+    python -m bsql.prepare
+    python -m bsql.prepare --models vegalite --force
+"""
+
+from typing import Dict, List
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+
+import torch
+
+from bsql.model import Model, find_snapshot, snapshot_path
+from bsql.sql.sqlcoder import SQLCoder
+from bsql.utils import load_config
+from bsql.viz.llama2 import Data2Viz
+from bsql.viz.vegalite import VegaLite
+
+MODEL_NAMES = ["sqlcoder", "data2viz", "vegalite"]
+
+_LOG = logging.getLogger(__name__)
+
+
+def bin_dir(name: str, config: dict) -> str:
+    """Directory holding the snapshots of a model"""
+    if name == "sqlcoder":
+        return config.get("MODEL_BIN_DIR_T2SQL", "models")
+    return config.get("MODEL_BIN_DIR_D2V", "models")
+
+
+def build_model(name: str, config: dict, prepared: bool = True) -> Model:
+    """Create a served model, from its prepared snapshot when there is one
+
+    Args:
+        name: one of ``MODEL_NAMES``.
+        config: project configuration.
+        prepared: False always loads from the hub, as when preparing.
+    """
+    directory = bin_dir(name, config) if prepared else None
+    if name == "sqlcoder":
+        model = SQLCoder(
+            assisted=config.get("ASSISTED_DECODING_T2SQL"),
+            draft_model_name=config.get("DRAFT_MODEL_T2SQL"),
+            num_assistant_tokens=config.get("NUM_ASSISTANT_TOKENS_T2SQL", 10),
+        )
+        if model.draft_model_name:
+            model.draft_snapshot_dir = find_snapshot(directory, model.draft_model_name)
+    elif name == "data2viz":
+        model = Data2Viz()
+    elif name == "vegalite":
+        model = VegaLite()
+    else:
+        raise ValueError(f"Unknown model {name!r}, use one of {MODEL_NAMES}")
+    model.snapshot_dir = find_snapshot(directory, model.model_name)
+    if prepared and model.snapshot_dir is None:
+        _LOG.warning("No snapshot of %s, run `python -m bsql.prepare`", name)
+    return model
+
+
+def prepare(names: List[str], config: dict, force: bool = False) -> Dict[str, dict]:
+    """Save a snapshot of each model, skipping the ones already prepared"""
+    report = {}
+    for name in names:
+        model = build_model(name, config, prepared=False)
+        directory = bin_dir(name, config)
+        path = snapshot_path(directory, model.model_name)
+        draft_name = getattr(model, "draft_model_name", None)
+        prepared = find_snapshot(directory, model.model_name) and (
+            not draft_name or find_snapshot(directory, draft_name)
+        )
+        if not force and prepared:
+            report[name] = {"path": path, "skipped": True}
+            continue
+
+        start = time.perf_counter()
+        model.load_model()
+        loaded = time.perf_counter()
+        model.save_snapshot(path)
+        if getattr(model, "draft_model", None) is not None:
+            draft_path = snapshot_path(directory, draft_name)
+            model.draft_model.save_pretrained(draft_path, safe_serialization=True)
+            model.tokenizer.save_pretrained(draft_path)
+        report[name] = {
+            "path": path,
+            "load_s": loaded - start,
+            "save_s": time.perf_counter() - loaded,
+        }
+
+        # Only one model in memory at a time
+        del model
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--models", default=",".join(MODEL_NAMES), help="comma separated models"
+    )
+    parser.add_argument("--force", action="store_true", help="overwrite snapshots")
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    report = prepare(args.models.split(","), config, args.force)
+    for entry in report.values():
+        entry["size_mb"] = sum(
+            os.path.getsize(os.path.join(entry["path"], file))
+            for file in os.listdir(entry["path"])
+        ) / 2**20
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
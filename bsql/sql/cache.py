@@ -0,0 +1,372 @@
+"""Semantic question to SQL cache"""
+
+from functools import lru_cache
+from typing import Callable, List, Optional
+import atexit
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from bsql import telemetry
+
+STOPWORDS = {
+    "a",
+    "all",
+    "an",
+    "and",
+    "are",
+    "can",
+    "do",
+    "does",
+    "for",
+    "give",
+    "in",
+    "is",
+    "list",
+    "me",
+    "of",
+    "please",
+    "show",
+    "the",
+    "there",
+    "to",
+    "we",
+    "what",
+    "which",
+    "with",
+    "you",
+}
+# Phrasings of the same aggregation or entity, rewritten before embedding
+SYNONYMS = [
+    (r"\bhow many\b|\bnumber of\b|\bcount of\b", " count "),
+    (r"\bheadcount\b", " count employee "),
+    (r"\baverage\b|\bavg\b|\bmean\b", " average "),
+    (r"\btotal\b|\bsum of\b|\bsum\b", " total "),
+    (r"\bmaximum\b|\bhighest\b|\blargest\b|\bmax\b|\btop\b", " maximum "),
+    (r"\bminimum\b|\blowest\b|\bsmallest\b|\bmin\b|\bbottom\b", " minimum "),
+    (r"\bdepts?\b|\bdepartments?\b", " department "),
+    (r"\bstaff\b|\bworkers?\b|\bemployees\b|\bpeople\b", " employee "),
+    (r"\bper\b|\bby\b|\beach\b|\bevery\b|\bgrouped\b", " by "),
+]
+
+# Words the synonyms above normalize to
+CANONICAL = {
+    "average",
+    "by",
+    "count",
+    "department",
+    "employee",
+    "maximum",
+    "minimum",
+    "total",
+}
+NEGATIONS = {"not", "no", "non", "never", "without", "except", "excluding", "exclude"}
+
+
+def content_words(text: str) -> List[str]:
+    """Normalized, singularized words of a question without stopwords"""
+    text = text.lower()
+    for pattern, replacement in SYNONYMS:
+        text = re.sub(pattern, replacement, text)
+    return [
+        word.rstrip("s") if len(word) > 3 else word
+        for word in re.findall(r"[a-z0-9]+", text)
+        if word not in STOPWORDS
+    ]
+
+
+@lru_cache(maxsize=16)
+def schema_identifiers(schema: str) -> frozenset:
+    """Table and column names of a schema, without the sample values"""
+    lines = (line.split("--")[0] for line in schema.lower().splitlines())
+    return frozenset(re.findall(r"[a-z0-9_]+", " ".join(lines)))
+
+
+def question_signature(question: str, schema: str) -> frozenset:
+    """What a question asks for, it must be the same for a hit
+
+    The aggregation and grouping words after synonym rewriting, the schema names
+    the other words refer to (exactly, or as part of a name for words of four
+    letters or more) and the remaining words, such as numbers, negations and
+    filters like "active", "women" or "left". A different aggregation, an extra
+    grouping column or an added filter all change the signature.
+    """
+    identifiers = schema_identifiers(schema)
+    signature = set()
+    for word in content_words(question):
+        if word.isdigit() or word in NEGATIONS:
+            signature.add(("guard", word))
+        elif word in CANONICAL:
+            signature.add(("operation", word))
+        else:
+            names = {
+                name
+                for name in identifiers
+                if word == name or (len(word) >= 4 and word in name)
+            }
+            if names:
+                signature |= {("name", name) for name in names}
+            else:
+                signature.add(("guard", word))
+    return frozenset(signature)
+
+
+def schema_fingerprint(schema: str) -> str:
+    """Fingerprint of the schema a query was generated for"""
+    return hashlib.sha1(schema.encode("utf8")).hexdigest()
+
+
+class HashingEmbedder:
+    """Dependency free question embedding
+
+    Normalizes common paraphrases, then hashes word unigrams, bigrams and character
+    trigrams into a fixed size L2 normalized vector.
+
+    Args:
+        dim: size of the embedding.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        words = content_words(text)
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f" {word} "
+            features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return features
+
+    def __call__(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.md5(feature.encode("utf8")).digest()
+            weight = 2.0 if feature[0] != "c" else 1.0
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceEmbedder:
+    """Question embedding with a sentence-transformers model
+
+    Args:
+        model_name: sentence-transformers model to load.
+    """
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import (  # pylint: disable=import-outside-toplevel
+                SentenceTransformer,
+            )
+        except ImportError as e:
+            raise ImportError(
+                "SentenceEmbedder requires `pip install sentence-transformers`"
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def __call__(self, text: str) -> np.ndarray:
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+class SemanticSQLCache:
+    """Nearest-neighbour cache of generated SQL keyed by question embeddings
+
+    Entries record the question, the schema fingerprint, the SQL and whether it
+    executed successfully. A lookup returns the SQL of the most similar successful
+    question generated for the same schema, provided the similarity is above the
+    threshold, both questions have the same ``question_signature`` (aggregations,
+    schema names, filters, numbers and negations) and the SQL still passes
+    ``EXPLAIN`` on the current database.
+
+    Args:
+        path: ``.npz`` file the index is persisted to, None keeps it in memory.
+        embedder: callable mapping a question to a normalized vector.
+        threshold: minimum cosine similarity of a hit.
+        max_entries: size of the index, least recently used entries are evicted.
+        save_interval: minimum seconds between writes of the index, pending changes
+            are also written at exit.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        embedder: Optional[Callable[[str], np.ndarray]] = None,
+        threshold: float = 0.85,
+        max_entries: int = 1000,
+        save_interval: float = 10.0,
+    ):
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries: List[dict] = []
+        self.embeddings: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+        self.save_interval = save_interval
+        self._clock = 0
+        self._dirty = False
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+        if path:
+            atexit.register(self.flush)
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _explain(self, sql: str, conn) -> bool:
+        try:
+            conn.execute(f"EXPLAIN {sql.strip().rstrip(';')}")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def lookup(self, question: str, schema: str, conn=None) -> Optional[str]:
+        """Return cached SQL for a question similar enough to a past one
+
+        Args:
+            question: the user's question.
+            schema: the schema the SQL would be generated for.
+            conn: database connection to ``EXPLAIN`` the SQL on, None skips the check.
+
+        Returns:
+            The cached SQL, or None on a miss.
+        """
+        fingerprint = schema_fingerprint(schema)
+        embedding = self.embedder(question)
+        signature = question_signature(question, schema)
+        with self._lock:
+            sql = None
+            if self.entries:
+                similarities = self.embeddings @ embedding
+                for index in np.argsort(-similarities):
+                    if similarities[index] < self.threshold:
+                        break
+                    entry = self.entries[index]
+                    if (
+                        entry["schema"] == fingerprint
+                        and entry["success"]
+                        and question_signature(entry["question"], schema) == signature
+                    ):
+                        sql = entry["sql"]
+                        break
+            if sql is not None and conn is not None and not self._explain(sql, conn):
+                entry["success"] = False
+                sql = None
+                self._dirty = True
+                self._maybe_save(force=True)
+            if sql is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry["hits"] += 1
+                entry["last_used"] = self._tick()
+        telemetry.record_cache("semantic_sql", sql is not None)
+        return sql
+
+    def add(self, question: str, schema: str, sql: str, success: bool = True):
+        """Record the SQL generated for a question and whether it executed
+
+        A failure also marks every other entry holding the same SQL for the schema,
+        such as the one a cache hit reused it from.
+        """
+        fingerprint = schema_fingerprint(schema)
+        with self._lock:
+            if not success:
+                for entry in self.entries:
+                    if entry["sql"] == sql and entry["schema"] == fingerprint:
+                        self._dirty |= entry["success"]
+                        entry["success"] = False
+            for entry in self.entries:
+                if entry["question"] == question and entry["schema"] == fingerprint:
+                    self._dirty |= entry["sql"] != sql or entry["success"] != success
+                    entry.update(sql=sql, success=success, last_used=self._tick())
+                    break
+            else:
+                self._dirty = True
+                embedding = self.embedder(question)[None, :]
+                self.entries.append(
+                    {
+                        "question": question,
+                        "schema": fingerprint,
+                        "sql": sql,
+                        "success": success,
+                        "hits": 0,
+                        "last_used": self._tick(),
+                    }
+                )
+                self.embeddings = (
+                    embedding
+                    if self.embeddings is None
+                    else np.vstack([self.embeddings, embedding])
+                )
+                self._evict()
+            # Failures are persisted right away so a restart cannot reuse the SQL
+            self._maybe_save(force=not success)
+
+    def _maybe_save(self, force: bool = False):
+        """Persist changes at most every ``save_interval`` seconds"""
+        if not self.path or not self._dirty:
+            return
+        if not force and time.monotonic() - self._saved_at < self.save_interval:
+            return
+        self._save()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def flush(self):
+        """Persist any pending change"""
+        with self._lock:
+            self._maybe_save(force=True)
+
+    def _evict(self):
+        if len(self.entries) <= self.max_entries:
+            return
+        keep = np.argsort([-entry["last_used"] for entry in self.entries])
+        keep = np.sort(keep[: self.max_entries])
+        self.entries = [self.entries[index] for index in keep]
+        self.embeddings = self.embeddings[keep]
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            embeddings=self.embeddings,
+            entries=np.array(json.dumps(self.entries)),
+        )
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Load the persisted index"""
+        with np.load(self.path, allow_pickle=False) as data:
+            entries = json.loads(str(data["entries"]))
+            embeddings = data["embeddings"]
+        # An index built with another embedder cannot be searched
+        if embeddings.shape[-1] != self.embedder("").shape[-1]:
+            return
+        self.entries, self.embeddings = entries, embeddings
+        self._clock = max((entry["last_used"] for entry in self.entries), default=0)
+
+    def report(self) -> dict:
+        """Size and hit rate of the cache"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
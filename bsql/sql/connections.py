@@ -0,0 +1,90 @@
+"""Thread-safe connections to a shared SQLite database"""
+
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import quote
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import weakref
+
+
+def _remove(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class ConnectionManager:
+    """One writer and pooled read-only connections to a file-backed WAL database
+
+    In WAL mode readers never block each other or the writer, and ``sqlite3``
+    releases the GIL while a statement runs, so a long query on one connection does
+    not hold up queries on the others. A connection is only ever used by the thread
+    that checked it out.
+
+    Args:
+        path: database file, None uses a temporary file removed with the manager.
+        max_idle: idle read connections kept open for reuse, extra ones are closed.
+        timeout: seconds to wait on a locked database.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_idle: int = 8, timeout=30.0):
+        self._finalizer = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="bsql-", suffix=".sqlite")
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove, path)
+        self.path = path
+        self.timeout = timeout
+        self._writer = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._write_lock = threading.Lock()
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            f"file:{quote(os.path.abspath(self.path))}?mode=ro",
+            uri=True,
+            timeout=self.timeout,
+            check_same_thread=False,
+        )
+
+    @contextmanager
+    def writer(self):
+        """The writer connection, committed on exit and used by one thread at a time"""
+        with self._write_lock:
+            with self._writer:
+                yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """A read-only connection for the duration of the block"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        """Close every connection and remove a temporary database"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._writer.close()
+        if self._finalizer is not None:
+            self._finalizer()
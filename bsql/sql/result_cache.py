@@ -0,0 +1,262 @@
+"""Query result cache invalidated by table versions"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, FrozenSet, Optional, Tuple
+import threading
+
+import pandas as pd
+import sqlparse
+from sqlparse import tokens as T
+
+from bsql import telemetry
+
+
+# Functions whose result changes between runs of the same query
+VOLATILE = {
+    "random",
+    "randomblob",
+    "changes",
+    "last_insert_rowid",
+    "total_changes",
+    "current_date",
+    "current_time",
+    "current_timestamp",
+}
+
+
+def normalize_sql(sql: str) -> str:
+    """Fold whitespace, comments and keyword/identifier case out of a query
+
+    Tokens are joined with one canonical spacing whatever the original whitespace:
+    none before ``,`` ``;`` ``(`` ``)`` ``.`` or after ``(`` ``.``, a single
+    space everywhere else. String literals are single tokens and kept as is.
+    """
+    sql = sqlparse.format(
+        sql, keyword_case="upper", identifier_case="lower", strip_comments=True
+    )
+    values = []
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.is_whitespace:
+                continue
+            # The lexer reads "x-1" as x and -1 but "x - 1" as x, - and 1
+            if token.ttype in T.Number and token.value[0] in "+-":
+                values += [token.value[0], token.value[1:]]
+            else:
+                values.append(token.value)
+    parts = []
+    for index, value in enumerate(values):
+        if (
+            index
+            and values[index - 1] not in ("(", ".")
+            and value not in (",", ";", "(", ")", ".")
+        ):
+            parts.append(" ")
+        parts.append(value)
+    return "".join(parts).rstrip(";").strip()
+
+
+def referenced_names(sql: str) -> FrozenSet[str]:
+    """Lower cased names (tables, columns, aliases) appearing in a query"""
+    names = set()
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.ttype in T.Name or token.ttype in T.Literal.String.Symbol:
+                names.add(token.value.strip('"`[]').lower())
+    return frozenset(names)
+
+
+def is_deterministic(sql: str) -> bool:
+    """Whether a query returns the same result on the same data"""
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            value = token.value.lower()
+            if value in VOLATILE or value in ("'now'", '"now"'):
+                return False
+    return True
+
+
+@lru_cache(maxsize=1024)
+def _parse(sql: str) -> Tuple[str, FrozenSet[str], bool]:
+    # Parsing costs more than a small query, so repeated SQL is only parsed once
+    return normalize_sql(sql), referenced_names(sql), is_deterministic(sql)
+
+
+def _compact(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """Columnar copy using categories for repetitive strings and small integers
+
+    Returns:
+        The compact frame and the original dtype of every column it changed.
+    """
+    dtypes = {}
+    compact = {}
+    for column in df.columns:
+        series = df[column]
+        dtype = series.dtype
+        if pd.api.types.is_string_dtype(series) and len(series):
+            if series.nunique(dropna=False) <= len(series) // 2:
+                category = series.astype("category")
+                # Small frames are smaller without the categories
+                if category.memory_usage(deep=True) < series.memory_usage(deep=True):
+                    series = category
+        elif pd.api.types.is_integer_dtype(series) and not isinstance(
+            series.dtype, pd.api.types.CategoricalDtype
+        ):
+            series = pd.to_numeric(series, downcast="integer")
+        if series.dtype != dtype:
+            dtypes[column] = dtype
+        compact[column] = series
+    return pd.DataFrame(compact, index=df.index), dtypes
+
+
+class ResultCache:
+    """Cache of query results and their summaries
+
+    Entries are keyed by the normalized SQL and the version of every table it
+    references; queries using volatile functions like ``random()`` are not cached.
+    Ingestion calls ``invalidate_table`` which bumps the version and drops the
+    entries reading from that table. Frames are stored compacted and the least
+    recently used entries are evicted to stay under ``max_bytes``.
+
+    Args:
+        max_bytes: memory budget of the cached frames.
+        enabled: False makes every lookup miss and stores nothing.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.versions: Dict[str, int] = {}
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, sql: str) -> Optional[tuple]:
+        if not self.enabled:
+            return None
+        normalized, names, deterministic = _parse(sql)
+        tables = sorted(names & self.versions.keys())
+        if not tables or not deterministic:
+            # Nothing to invalidate it by or a different result each run
+            return None
+        return normalized, tuple((t, self.versions[t]) for t in tables)
+
+    def clear(self):
+        """Drop every entry and reset the hit counters"""
+        with self._lock:
+            self.entries.clear()
+            self.size = self.hits = self.misses = 0
+
+    def invalidate_table(self, table: str):
+        """Bump the version of an ingested table and drop the results reading it"""
+        table = table.lower()
+        with self._lock:
+            self.versions[table] = self.versions.get(table, 0) + 1
+            for key in [key for key in self.entries if table in dict(key[1])]:
+                self.size -= self.entries.pop(key)["bytes"]
+
+    def get(self, sql: str) -> Optional[pd.DataFrame]:
+        """Cached result of a query"""
+        with self._lock:
+            key = self._key(sql)
+            entry = self.entries.get(key) if key else None
+            if entry is not None:
+                self.entries.move_to_end(key)
+            self.hits += entry is not None
+            self.misses += entry is None
+        telemetry.record_cache("result", entry is not None)
+        if entry is None:
+            return None
+        frame = entry["frame"].copy()
+        # Per column, DataFrame.astype with a mapping is much slower on small frames
+        for column, dtype in entry["dtypes"].items():
+            frame[column] = frame[column].astype(dtype)
+        return frame
+
+    def put(self, sql: str, df: pd.DataFrame):
+        """Cache the result of a query"""
+        frame, dtypes = _compact(df)
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            key = self._key(sql)
+            if key is None:
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key)["bytes"]
+            self.entries[key] = {
+                "frame": frame,
+                "dtypes": dtypes,
+                "summary": None,
+                "bytes": size,
+            }
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted["bytes"]
+
+    def get_summary(self, sql: str) -> Optional[str]:
+        """Cached summary of a query result"""
+        with self._lock:
+            key = self._key(sql)
+            entry = self.entries.get(key) if key else None
+            return entry["summary"] if entry else None
+
+    def put_summary(self, sql: str, summary: str):
+        """Attach the summary to a cached query result"""
+        with self._lock:
+            key = self._key(sql)
+            entry = self.entries.get(key) if key else None
+            if entry is not None:
+                entry["summary"] = summary
+                entry["bytes"] += len(summary)
+                self.size += len(summary)
+
+    def report(self) -> dict:
+        """Size and hit rate of the cache"""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Spellings of one query that must share a cache key, checked by running the module
+EQUIVALENT_QUERIES = [
+    [
+        "SELECT a,b FROM t WHERE x='A  B'",
+        "select a , b from t where x = 'A  B';",
+        "SELECT a, b\nFROM t WHERE x= 'A  B'",
+        "SELECT  a ,b FROM t WHERE x ='A  B' -- comment",
+    ],
+    [
+        "SELECT x-1 FROM t WHERE y=-1",
+        "SELECT x - 1 FROM t WHERE y = - 1",
+        "select x -1 from t where y= -1",
+    ],
+    [
+        "SELECT COUNT(*) AS c, e.x FROM t e WHERE z IN (1,2) GROUP BY e.x",
+        "SELECT COUNT( * )AS c,e . x FROM t e WHERE z IN(1 , 2)GROUP BY e.x",
+    ],
+]
+
+
+if __name__ == "__main__":
+    import sys
+
+    for queries in EQUIVALENT_QUERIES:
+        keys = {normalize_sql(query) for query in queries}
+        if len(keys) != 1:
+            sys.exit(f"Different keys for one query: {sorted(keys)}")
+    # Whitespace inside a literal is data, not formatting
+    if normalize_sql("SELECT 'a  b'") == normalize_sql("SELECT 'a b'"):
+        sys.exit("Whitespace inside a string literal was collapsed")
+    print(f"{len(EQUIVALENT_QUERIES)} groups of queries normalize to one key each")
@@ -1,32 +1,212 @@
 """Implementation for SQLCoder model"""
 
+from typing import List, Optional
 import re
+import time
 
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 
+from bsql import telemetry
 from bsql.model import Model
 
 
 class SQLCoder(Model):
-    """SQLCoder model"""
+    """SQLCoder model
 
-    model_name = "defog/sqlcoder-7b-2"
+    Greedy decoding can be assisted by a drafter proposing several tokens that the
+    model verifies in a single forward pass. The output is identical to plain greedy
+    decoding, only the number of forward passes changes.
 
-    def _load_model(self):
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
+    Args:
+        model_name: base model name.
+        assisted: None for plain greedy decoding, "prompt_lookup" to draft tokens from
+            n-gram matches against the prompt (table and column names are mostly
+            copied from the schema) or "draft" to draft them with a small model.
+        draft_model_name: small model sharing the tokenizer, used in "draft" mode.
+        num_assistant_tokens: number of tokens drafted per step.
+        device: device to run on, "cpu" allows testing with tiny models.
+        snapshot_dir: prepared snapshot of the model, None loads from the hub.
+        draft_snapshot_dir: prepared snapshot of the draft model.
+    """
+
+    assisted_modes = (None, "prompt_lookup", "draft")
+
+    def __init__(
+        self,
+        model_name: str = "defog/sqlcoder-7b-2",
+        assisted: Optional[str] = None,
+        draft_model_name: Optional[str] = None,
+        num_assistant_tokens: int = 10,
+        device: str = "cuda",
+        snapshot_dir: Optional[str] = None,
+        draft_snapshot_dir: Optional[str] = None,
+    ):
+        super().__init__(snapshot_dir)
+        self.model_name = model_name
+        self.assisted = assisted or None
+        self.draft_model_name = draft_model_name
+        self.draft_snapshot_dir = draft_snapshot_dir
+        self.num_assistant_tokens = num_assistant_tokens
+        self.device = device
+        self.draft_model = None
+        self.stats = {
+            "generations": 0,
+            "new_tokens": 0,
+            "target_forwards": 0,
+            "draft_forwards": 0,
+            "proposed_tokens": 0,
+            "accepted_tokens": 0,
+            "seconds": 0.0,
+        }
+
+    @property
+    def snapshot_dirs(self) -> List[str]:
+        return [path for path in (self.snapshot_dir, self.draft_snapshot_dir) if path]
+
+    def _from_pretrained(self, model_name: str):
+        on_cuda = self.device == "cuda"
+        return AutoModelForCausalLM.from_pretrained(
+            model_name,
             trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="auto",
+            torch_dtype=torch.float16 if on_cuda else torch.float32,
+            device_map="auto" if on_cuda else None,
             use_cache=True,
         )
 
-    def inference(self, question: str, schema: str) -> str:
-        """Run model inference"""
+    def _load_model(self):
+        self.tokenizer = AutoTokenizer.from_pretrained(self.source)
+        self.model = self._from_pretrained(self.source)
+        if self.draft_model_name:
+            self.draft_model = self._from_pretrained(
+                self.draft_snapshot_dir or self.draft_model_name
+            )
+        if self.device != "cuda":
+            self.model.to(self.device)
+            if self.draft_model is not None:
+                self.draft_model.to(self.device)
+
+    def _assisted_kwargs(self) -> dict:
+        if self.assisted not in self.assisted_modes:
+            raise ValueError(
+                f"Unknown assisted mode {self.assisted!r}, "
+                f"use one of {self.assisted_modes}"
+            )
+        if self.assisted == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.num_assistant_tokens}
+        if self.assisted == "draft":
+            assert self.draft_model, "Please set draft_model_name for draft mode"
+            self.draft_model.generation_config.num_assistant_tokens = (
+                self.num_assistant_tokens
+            )
+            return {"assistant_model": self.draft_model}
+        return {}
+
+    def _count_candidates(self, counts: dict):
+        """Wrap the model's candidate generator to count proposed and accepted tokens
+
+        Works for both assisted modes since prompt lookup and the draft model are
+        candidate generators alike.
+        """
+        original = self.model._get_candidate_generator  # pylint: disable=protected-access
+
+        def get_candidate_generator(*args, **kwargs):
+            generator = original(*args, **kwargs)
+            get_candidates = generator.get_candidates
+            update_candidate_strategy = generator.update_candidate_strategy
+
+            def counted_get_candidates(input_ids):
+                candidate_ids, candidate_logits = get_candidates(input_ids)
+                counts["proposed"] += candidate_ids.shape[-1] - input_ids.shape[-1]
+                return candidate_ids, candidate_logits
+
+            def counted_update(input_ids, scores, num_matches):
+                counts["accepted"] += int(num_matches)
+                return update_candidate_strategy(input_ids, scores, num_matches)
+
+            generator.get_candidates = counted_get_candidates
+            generator.update_candidate_strategy = counted_update
+            return generator
+
+        self.model._get_candidate_generator = get_candidate_generator
+
+    def _count_forwards(self, generate, **kwargs):
+        """Run generate counting forward passes and proposed/accepted candidates"""
+        counts = {"target": 0, "draft": 0, "proposed": 0, "accepted": 0}
+
+        def counter(key):
+            def hook(*_):
+                counts[key] += 1
+
+            return hook
+
+        handles = [self.model.register_forward_pre_hook(counter("target"))]
+        if self.assisted == "draft":
+            handles.append(
+                self.draft_model.register_forward_pre_hook(counter("draft"))
+            )
+        if self.assisted:
+            self._count_candidates(counts)
+        start = time.perf_counter()
+        try:
+            generated_ids = generate(**kwargs)
+        finally:
+            for handle in handles:
+                handle.remove()
+            if self.assisted:
+                del self.model._get_candidate_generator
+
+        new_tokens = generated_ids.shape[-1] - kwargs["input_ids"].shape[-1]
+        self.stats["generations"] += 1
+        self.stats["new_tokens"] += new_tokens
+        self.stats["target_forwards"] += counts["target"]
+        self.stats["draft_forwards"] += counts["draft"]
+        self.stats["proposed_tokens"] += counts["proposed"]
+        self.stats["accepted_tokens"] += counts["accepted"]
+        self.stats["seconds"] += time.perf_counter() - start
+
+        mode = self.assisted or "greedy"
+        telemetry.FORWARD_PASSES.inc(counts["target"], model="SQLCoder", mode=mode)
+        if self.assisted:
+            telemetry.DRAFT_TOKENS.inc(
+                counts["proposed"], model="SQLCoder", result="proposed"
+            )
+            telemetry.DRAFT_TOKENS.inc(
+                counts["accepted"], model="SQLCoder", result="accepted"
+            )
+        return generated_ids
+
+    def report(self) -> dict:
+        """Tokens/sec, tokens per forward pass and candidate acceptance rate"""
+        stats = self.stats
+        return {
+            "mode": self.assisted or "greedy",
+            **stats,
+            "tokens_per_second": stats["new_tokens"] / stats["seconds"]
+            if stats["seconds"]
+            else 0.0,
+            "tokens_per_forward": stats["new_tokens"] / stats["target_forwards"]
+            if stats["target_forwards"]
+            else 0.0,
+            "acceptance_rate": stats["accepted_tokens"] / stats["proposed_tokens"]
+            if stats["proposed_tokens"]
+            else None,
+        }
+
+    def inference(self, question: str, schema: str, stopping_criteria=None) -> str:
+        """Run model inference
+
+        Args:
+            question: the user's question.
+            schema: schema of the database the query runs on.
+            stopping_criteria: extra stopping criteria, e.g. to preempt background work.
+
+        Returns:
+            The SQL query.
+        """
         self.load_model()
-        prompt = """### Task
+        with telemetry.span("prompt_build"):
+            prompt = """### Task
 Generate a SQL query to answer the following question:
 `{question}`
 
@@ -37,24 +217,33 @@ This query will run on a database whose schema is represented in this string:
 Given the database schema, here is the SQL query that answers `{question}`:
 ```sql
 """.format(
-            question=question, schema=schema
-        )
+                question=question, schema=schema
+            )
         assert self.tokenizer, "Please load the model first"
         assert self.model, "Please load the model first"
         eos_token_id = self.tokenizer.eos_token_id
-        inputs = self.tokenizer(prompt, return_tensors="pt").to("cuda")
-        generated_ids = self.model.generate(
-            **inputs,
+        with telemetry.span("tokenize"):
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        generated_ids = self._count_forwards(
+            self.generate,
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
             num_return_sequences=1,
             eos_token_id=eos_token_id,
             pad_token_id=eos_token_id,
             max_new_tokens=400,
             do_sample=False,
             num_beams=1,
+            stopping_criteria=stopping_criteria,
+            **self._assisted_kwargs(),
         )
-        outputs = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
-        torch.cuda.empty_cache()
-        torch.cuda.synchronize()
+        with telemetry.span("detokenize"):
+            outputs = self.tokenizer.batch_decode(
+                generated_ids, skip_special_tokens=True
+            )
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.synchronize()
 
         def postgres_to_sqlite(query: str) -> str:
             substitutions = [
@@ -0,0 +1,303 @@
+"""Per-stage tracing and Prometheus-style metrics
+
+Spans time a pipeline stage, record it in the ``bsql_stage_seconds`` histogram and
+log it with the current trace id. Trace ids travel from the app to the model server
+in the ``X-Trace-Id`` header. Set ``BSQL_TELEMETRY=0`` to turn everything into
+no-ops.
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+
+ENABLED = os.environ.get("BSQL_TELEMETRY", "1") != "0"
+TRACE_HEADER = "X-Trace-Id"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_LOG = logging.getLogger("bsql.trace")
+_trace_id = contextvars.ContextVar("bsql_trace_id", default=None)
+_NOOP = nullcontext()
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    @abstractmethod
+    def _samples(self):
+        pass
+
+    def render(self) -> str:
+        """Prometheus text exposition of the metric"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase the counter"""
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Current value of the counter"""
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        """Decrease the gauge"""
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        """Set the gauge"""
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple, list] = {}
+        self._sums: Dict[Tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        """Record an observation"""
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def _samples(self):
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labels, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {self._sums[key]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, returning the existing one if the name is taken"""
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("bsql_stage_seconds", "Latency of each pipeline stage.", ["stage"])
+)
+TOKENS_PER_SECOND = REGISTRY.register(
+    Histogram(
+        "bsql_decode_tokens_per_second",
+        "Decode throughput per generation.",
+        ["model"],
+        buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 200),
+    )
+)
+GENERATED_TOKENS = REGISTRY.register(
+    Counter("bsql_generated_tokens_total", "Tokens generated.", ["model"])
+)
+FORWARD_PASSES = REGISTRY.register(
+    Counter(
+        "bsql_forward_passes_total",
+        "Forward passes of the generating model.",
+        ["model", "mode"],
+    )
+)
+DRAFT_TOKENS = REGISTRY.register(
+    Counter(
+        "bsql_draft_tokens_total",
+        "Draft tokens proposed and accepted in assisted decoding.",
+        ["model", "result"],
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("bsql_queue_depth", "Inference requests waiting or running.")
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "bsql_cache_requests_total", "Cache lookups by outcome.", ["cache", "result"]
+    )
+)
+MODEL_MEMORY = REGISTRY.register(
+    Gauge("bsql_model_memory_bytes", "Memory held by each loaded model.", ["model"])
+)
+CHART_RECOMMENDER = REGISTRY.register(
+    Gauge(
+        "bsql_chart_recommender",
+        "Chart recommender hit rate, latencies and seconds saved by skipping the LLM.",
+        ["stat"],
+    )
+)
+MODEL_READY_SECONDS = REGISTRY.register(
+    Gauge(
+        "bsql_model_ready_seconds",
+        "Seconds from server start until each model was loaded and warmed up.",
+        ["model"],
+    )
+)
+
+
+def new_trace_id() -> str:
+    """Generate a trace id"""
+    return uuid.uuid4().hex
+
+
+def get_trace_id() -> Optional[str]:
+    """Trace id of the current context"""
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None):
+    """Run the enclosed block under a trace id, generating one if not given"""
+    token = _trace_id.set(trace_id or new_trace_id())
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+def record_span(stage: str, seconds: float):
+    """Record a stage timed by the caller"""
+    if not ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    _LOG.debug(
+        "trace=%s span=%s duration_ms=%.2f", get_trace_id(), stage, 1000 * seconds
+    )
+
+
+@contextmanager
+def _span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def span(stage: str):
+    """Time the enclosed block as a pipeline stage"""
+    return _span(stage) if ENABLED else _NOOP
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def headers() -> Dict[str, str]:
+    """Headers propagating the current trace to the model server"""
+    trace_id = get_trace_id()
+    return {TRACE_HEADER: trace_id} if ENABLED and trace_id else {}
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve ``/metrics`` from a background thread, once per process"""
+    global _metrics_server  # pylint: disable=global-statement
+    if _metrics_server is not None or not ENABLED:
+        return _metrics_server
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serve the registry on ``/metrics``"""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    _metrics_server = ThreadingHTTPServer((host, port), Handler)
+    _metrics_server.daemon_threads = True
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
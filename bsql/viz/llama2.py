@@ -6,6 +6,7 @@ import warnings
 
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
+from bsql import telemetry
 from bsql.model import Model
 
 warnings.filterwarnings("ignore")
@@ -19,18 +20,18 @@ class Data2Viz(Model):
 
     model_name = "meta-llama/Llama-2-7b-chat-hf"
 
-    def __init__(self, model_name="meta-llama/Llama-2-7b-chat-hf"):
-        super().__init__()
+    def __init__(self, model_name="meta-llama/Llama-2-7b-chat-hf", snapshot_dir=None):
+        super().__init__(snapshot_dir)
         self.model_name = model_name
         self.is_loaded = False
 
     def _load_model(self):
         self.tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name,
+            self.source,
             token=hf_token,
         )
         self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
+            self.source,
             trust_remote_code=True,
             torch_dtype=torch.float16,
             device_map="auto",
@@ -58,10 +59,11 @@ class Data2Viz(Model):
         Assistant:
         """
         prompt = [{"role": "user", "content": prompt}]
-        inputs = self.tokenizer.apply_chat_template(prompt, return_tensors="pt").to(
-            "cuda"
-        )
-        generated_ids = self.model.generate(
+        with telemetry.span("tokenize"):
+            inputs = self.tokenizer.apply_chat_template(
+                prompt, return_tensors="pt"
+            ).to("cuda")
+        generated_ids = self.generate(
             inputs,
             num_return_sequences=1,
             eos_token_id=self.tokenizer.eos_token_id,
@@ -73,13 +75,14 @@ class Data2Viz(Model):
             repetition_penalty=1,
             num_beams=1,
         )
-        print("model generated")
-        outputs = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+        with telemetry.span("detokenize"):
+            outputs = self.tokenizer.batch_decode(
+                generated_ids, skip_special_tokens=True
+            )
         torch.cuda.empty_cache()
         torch.cuda.synchronize()
 
         response = outputs[0]
-        print("response returned")
         return response
 
     def generate_visualization(self, query_result: dict) -> str:
@@ -120,8 +123,7 @@ class Data2Viz(Model):
         Returns:
             List: List of three recommended questions
         """
-        if not self.is_loaded:
-            self._load_model()
+        self.load_model()
 
         prompt = f"""System: Use the given question to generate three questions you recommend to explore a database. us the provided question style.\
         to generated qestions in the same style. Try to generated questions that can be ploted by a python code to be visualy explored .\
@@ -129,10 +131,11 @@ class Data2Viz(Model):
         Assistant:
         """
         prompt = [{"role": "user", "content": prompt}]
-        inputs = self.tokenizer.apply_chat_template(prompt, return_tensors="pt").to(
-            "cuda"
-        )
-        generated_ids = self.model.generate(
+        with telemetry.span("tokenize"):
+            inputs = self.tokenizer.apply_chat_template(
+                prompt, return_tensors="pt"
+            ).to("cuda")
+        generated_ids = self.generate(
             inputs,
             num_return_sequences=1,
             eos_token_id=self.tokenizer.eos_token_id,
@@ -144,7 +147,10 @@ class Data2Viz(Model):
             repetition_penalty=1,
             num_beams=1,
         )
-        outputs = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+        with telemetry.span("detokenize"):
+            outputs = self.tokenizer.batch_decode(
+                generated_ids, skip_special_tokens=True
+            )
         torch.cuda.empty_cache()
         torch.cuda.synchronize()
 
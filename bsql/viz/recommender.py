@@ -0,0 +1,207 @@
+"""Rule-based Vega-Lite recommender for common result shapes"""
+
+from typing import List, Optional
+import re
+import time
+
+import pandas as pd
+
+VEGA_LITE_SCHEMA = "https://vega.github.io/schema/vega-lite/v5.json"
+
+
+def escape_field(column) -> str:
+    """Field name of a column, Vega-Lite reads ``.`` and ``[]`` as nested access
+
+    Unaliased aggregates like ``AVG(e.current_employee_rating)`` would otherwise
+    look up a missing nested field and render an empty chart.
+    """
+    return re.sub(r"([.\[\]])", r"\\\1", str(column))
+
+
+class ChartRecommender:
+    """Recommend a Vega-Lite spec from the dtypes and cardinalities of a result
+
+    Recognized shapes are answered directly without calling the LLM:
+        - one categorical and one numeric column -> bar chart (pie for few parts of a whole)
+        - one temporal and one numeric column -> line chart
+        - one numeric column -> histogram
+        - one categorical column -> count bar chart
+
+    Anything else is considered ambiguous and ``recommend`` returns ``None`` so
+    the caller can fall back to the LLM.
+
+    Args:
+        max_categories: maximum number of distinct values for a column to be
+            treated as a category axis.
+        max_pie_slices: maximum number of categories for a pie chart.
+    """
+
+    pie_keywords = ("percentage", "percent", "proportion", "share", "ratio", "breakdown")
+
+    def __init__(self, max_categories: int = 30, max_pie_slices: int = 6):
+        self.max_categories = max_categories
+        self.max_pie_slices = max_pie_slices
+        self.hits = 0
+        self.misses = 0
+        self.rule_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def _is_numeric(self, series: pd.Series) -> bool:
+        return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(
+            series
+        )
+
+    def _is_temporal(self, series: pd.Series) -> bool:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return True
+        if not pd.api.types.is_object_dtype(series):
+            return False
+        # SQLite hands dates back as strings, so sniff a few values
+        sample = series.dropna().astype(str).head(20)
+        if sample.empty or not sample.str.contains(r"\d").all():
+            return False
+        parsed = pd.to_datetime(sample, errors="coerce", format="mixed")
+        return bool(parsed.notna().all())
+
+    def _column_kinds(self, df: pd.DataFrame) -> List[str]:
+        kinds = []
+        for column in df.columns:
+            series = df[column]
+            if self._is_numeric(series):
+                kinds.append("quantitative")
+            elif self._is_temporal(series):
+                kinds.append("temporal")
+            elif series.nunique(dropna=True) <= self.max_categories:
+                kinds.append("nominal")
+            else:
+                kinds.append("unknown")
+        return kinds
+
+    def _title(self, question: str, default: str) -> str:
+        return question.strip() if question else default
+
+    def _category_value_spec(
+        self, question: str, category: str, value: str, n_categories: int
+    ) -> dict:
+        wants_pie = any(word in question.lower() for word in self.pie_keywords)
+        if wants_pie and n_categories <= self.max_pie_slices:
+            return {
+                "$schema": VEGA_LITE_SCHEMA,
+                "title": self._title(question, f"{value} by {category}"),
+                "mark": {"type": "arc", "tooltip": True},
+                "encoding": {
+                    "theta": {"field": escape_field(value), "type": "quantitative"},
+                    "color": {"field": escape_field(category), "type": "nominal"},
+                },
+            }
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": self._title(question, f"{value} by {category}"),
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "x": {"field": escape_field(category), "type": "nominal", "sort": "-y"},
+                "y": {"field": escape_field(value), "type": "quantitative"},
+            },
+        }
+
+    def _time_value_spec(self, question: str, time_column: str, value: str) -> dict:
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": self._title(question, f"{value} over {time_column}"),
+            "mark": {"type": "line", "point": True, "tooltip": True},
+            "encoding": {
+                "x": {"field": escape_field(time_column), "type": "temporal"},
+                "y": {"field": escape_field(value), "type": "quantitative"},
+            },
+        }
+
+    def _histogram_spec(self, question: str, value: str) -> dict:
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": self._title(question, f"Distribution of {value}"),
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "x": {"field": escape_field(value), "type": "quantitative", "bin": True},
+                "y": {"aggregate": "count", "type": "quantitative"},
+            },
+        }
+
+    def _count_spec(self, question: str, category: str) -> dict:
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": self._title(question, f"Count by {category}"),
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "x": {"field": escape_field(category), "type": "nominal", "sort": "-y"},
+                "y": {"aggregate": "count", "type": "quantitative"},
+            },
+        }
+
+    def _match(self, df: pd.DataFrame, question: str) -> Optional[dict]:
+        if df is None or df.empty or len(df.columns) > 2:
+            return None
+        kinds = self._column_kinds(df)
+        columns = list(df.columns)
+
+        if len(columns) == 1:
+            column = columns[0]
+            if kinds[0] == "quantitative" and df[column].nunique() > 1:
+                return self._histogram_spec(question, column)
+            if kinds[0] == "nominal" and len(df) > df[column].nunique():
+                return self._count_spec(question, column)
+            return None
+
+        if sorted(kinds) == ["nominal", "quantitative"]:
+            category = columns[kinds.index("nominal")]
+            value = columns[kinds.index("quantitative")]
+            # Repeated categories mean the rows are not one value per bar
+            if df[category].is_unique:
+                return self._category_value_spec(
+                    question, category, value, df[category].nunique()
+                )
+            return None
+
+        if sorted(kinds) == ["quantitative", "temporal"]:
+            time_column = columns[kinds.index("temporal")]
+            value = columns[kinds.index("quantitative")]
+            return self._time_value_spec(question, time_column, value)
+
+        return None
+
+    def recommend(self, df: pd.DataFrame, question: str = "") -> Optional[dict]:
+        """Recommend a Vega-Lite spec for the given query result
+
+        Args:
+            df: query result.
+            question: original user's question, used for the title and chart hints.
+
+        Returns:
+            A Vega-Lite spec (without data) or None if the shape is ambiguous.
+        """
+        start = time.perf_counter()
+        spec = self._match(df, question or "")
+        self.rule_seconds += time.perf_counter() - start
+        if spec is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return spec
+
+    def record_llm_latency(self, seconds: float) -> None:
+        """Record the latency of a fallback LLM chart generation"""
+        self.llm_calls += 1
+        self.llm_seconds += seconds
+
+    def report(self) -> dict:
+        """Hit rate and estimated latency saved by skipping the LLM"""
+        total = self.hits + self.misses
+        mean_llm = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "mean_rule_ms": 1000 * self.rule_seconds / total if total else 0.0,
+            "mean_llm_ms": 1000 * mean_llm,
+            "latency_saved_s": max(self.hits * mean_llm - self.rule_seconds, 0.0),
+        }
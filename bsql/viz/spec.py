@@ -0,0 +1,500 @@
+"""Tolerant parsing, validation and repair of generated Vega-Lite specs"""
+
+from typing import Iterable, List, Optional, Tuple
+import ast
+import difflib
+import functools
+import importlib
+import json
+import re
+import time
+
+import pandas as pd
+
+from bsql.viz.recommender import escape_field
+
+MARKS = {
+    "arc",
+    "area",
+    "bar",
+    "boxplot",
+    "circle",
+    "errorband",
+    "errorbar",
+    "geoshape",
+    "image",
+    "line",
+    "point",
+    "rect",
+    "rule",
+    "square",
+    "text",
+    "tick",
+    "trail",
+}
+TYPES = {"quantitative", "temporal", "ordinal", "nominal", "geojson"}
+POSITIONS = ("x", "y", "theta")
+COMPOSITIONS = ("layer", "hconcat", "vconcat", "concat", "facet", "repeat")
+_OPENERS = {"{": "}", "[": "]"}
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _normalize_json(text: str) -> str:
+    """Rewrite near-JSON into JSON
+
+    Handles single quoted strings, ``\\'`` escapes, Python literals, trailing
+    commas, text after the top level object and truncated output (cut back to the
+    last complete value and close any open brackets). A number cut at the end may
+    be incomplete, so it is dropped.
+    """
+    start = text.find("{")
+    if start == -1:
+        return ""
+
+    out: List[str] = []
+    stack: List[str] = []
+    # (output length, open brackets) after the last complete value
+    safe_point: Tuple[int, List[str]] = (0, [])
+    quote = None
+    escaped = False
+    # Whether the next token is a value rather than an object key
+    expect_value = False
+    string_is_value = False
+    i = start
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+                out.append(char)
+            elif char == "\\" and text.startswith("'", i + 1):
+                # \' is not a JSON escape
+                out.append("'")
+                i += 1
+            elif char == "\\":
+                escaped = True
+                out.append(char)
+            elif char == quote:
+                quote = None
+                out.append('"')
+                if string_is_value:
+                    safe_point = (len(out), list(stack))
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char in "\"'":
+            quote = char
+            string_is_value = expect_value or (stack and stack[-1] == "]")
+            expect_value = False
+            out.append('"')
+        elif char in _OPENERS:
+            stack.append(_OPENERS[char])
+            expect_value = False
+            out.append(char)
+            safe_point = (len(out), list(stack))
+        elif char == ":":
+            expect_value = True
+            out.append(char)
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack:
+                break
+            stack.pop()
+            out.append(char)
+            if not stack:
+                return "".join(out)
+            safe_point = (len(out), list(stack))
+        elif char == ",":
+            safe_point = (len(out), list(stack))
+            out.append(char)
+        elif char == "/" and text.startswith("//", i):
+            newline = text.find("\n", i)
+            i = len(text) if newline == -1 else newline
+            continue
+        else:
+            literal = next(
+                (lit for lit in _LITERALS.values() if text.startswith(lit, i)), None
+            ) or next((lit for lit in _LITERALS if text.startswith(lit, i)), None)
+            if literal:
+                out.append(_LITERALS.get(literal, literal))
+                i += len(literal)
+                expect_value = False
+                safe_point = (len(out), list(stack))
+                continue
+            if not char.isspace():
+                expect_value = False
+            out.append(char)
+        i += 1
+
+    # Truncated: keep everything up to the last complete value
+    length, open_brackets = safe_point
+    out = out[:length]
+    while out and (out[-1].isspace() or out[-1] == ","):
+        out.pop()
+    return "".join(out) + "".join(reversed(open_brackets))
+
+
+def parse_spec(text: str) -> Tuple[Optional[dict], bool]:
+    """Parse a generated Vega-Lite spec
+
+    Args:
+        text: raw model output.
+
+    Returns:
+        The parsed spec (or None) and whether the text had to be rewritten.
+    """
+    if not text:
+        return None, False
+    text = re.sub(r"```(?:json)?", "", text)
+    start, end = text.find("{"), text.rfind("}") + 1
+    if start != -1 and end > start:
+        try:
+            spec = json.loads(text[start:end])
+            if isinstance(spec, dict):
+                return spec, False
+        except json.JSONDecodeError:
+            pass
+
+    normalized = _normalize_json(text)
+    try:
+        spec = json.loads(normalized)
+    except json.JSONDecodeError:
+        try:
+            spec = ast.literal_eval(text[start:end])
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None, True
+    return (spec if isinstance(spec, dict) else None), True
+
+
+@functools.lru_cache(maxsize=1)
+def _schema_validator():
+    """Vega-Lite JSON schema validator, shipped with altair (a streamlit dependency)
+
+    Altair 5 ships the Vega-Lite v5 schema, altair 6 the v6 one.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        import jsonschema
+    except ImportError:
+        return None
+    for version in ("v5", "v6"):
+        try:
+            module = importlib.import_module(f"altair.vegalite.{version}.schema.core")
+        except ImportError:
+            continue
+        return jsonschema.Draft7Validator(module.load_schema())
+    return None
+
+
+def validate_spec(spec: dict) -> List[str]:
+    """Validate a spec against the Vega-Lite schema
+
+    The schema requires ``data``, which repaired specs leave out since the query
+    result is passed to the chart separately, so a named data source stands in
+    for it. Falls back to structural checks of the single view specs we ask the
+    model for when the schema is not available.
+
+    Returns:
+        A list of error messages, empty when the spec is valid.
+    """
+    if not isinstance(spec, dict):
+        return ["spec is not an object"]
+
+    validator = _schema_validator()
+    if validator is not None:
+        spec = {"data": {"name": "values"}, **spec}
+        return [error.message for error in validator.iter_errors(spec)]
+
+    errors = []
+    mark = spec.get("mark")
+    mark_type = mark.get("type") if isinstance(mark, dict) else mark
+    if mark_type not in MARKS:
+        errors.append(f"invalid mark {mark_type!r}")
+    encoding = spec.get("encoding")
+    if not isinstance(encoding, dict) or not encoding:
+        errors.append("missing encoding")
+        return errors
+    for channel, definition in encoding.items():
+        definitions = definition if isinstance(definition, list) else [definition]
+        for item in definitions:
+            if not isinstance(item, dict):
+                errors.append(f"encoding.{channel} is not an object")
+            elif item.get("type") is not None and item["type"] not in TYPES:
+                errors.append(f"encoding.{channel} has invalid type {item['type']!r}")
+    return errors
+
+
+def _infer_type(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "nominal"
+    if pd.api.types.is_numeric_dtype(series):
+        return "quantitative"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "temporal"
+    return "nominal"
+
+
+def _match_column(field: str, columns: Iterable[str]) -> Optional[str]:
+    """Map a field reference onto an existing column"""
+    columns = list(columns)
+    if field in columns:
+        return field
+
+    def key(name: str) -> str:
+        return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+    by_key = {key(column): column for column in columns}
+    if key(field) in by_key:
+        return by_key[key(field)]
+    matches = difflib.get_close_matches(key(field), list(by_key), n=1, cutoff=0.75)
+    return by_key[matches[0]] if matches else None
+
+
+def _collect(value, key: str) -> set:
+    """Every string stored under ``key`` anywhere in a transform"""
+    found = set()
+    if isinstance(value, dict):
+        for name, item in value.items():
+            if name == key:
+                items = item if isinstance(item, list) else [item]
+                found |= {entry for entry in items if isinstance(entry, str)}
+            found |= _collect(item, key)
+    elif isinstance(value, list):
+        for item in value:
+            found |= _collect(item, key)
+    return found
+
+
+def _transform_inputs(transform: dict) -> set:
+    """Fields a transform reads"""
+    referenced = set(re.findall(r"datum\.(\w+)", json.dumps(transform)))
+    return referenced | _collect(transform, "field") | _collect(transform, "groupby")
+
+
+def _transform_outputs(transform: dict) -> set:
+    """Fields a transform creates"""
+    return _collect(transform, "as")
+
+
+def repair_spec(spec: dict, df: pd.DataFrame) -> Optional[dict]:
+    """Repair a parsed spec against the real query result
+
+    Drops embedded data (the chart is rendered with the full result), unwraps
+    compositions into their first view, maps field references onto the real
+    columns (or fields created by transforms) and drops channels and transforms
+    that reference unknown fields.
+
+    Returns:
+        The repaired spec, or None when nothing chartable is left or a positional
+        channel references a field that cannot be mapped.
+    """
+    if "mark" not in spec:
+        for key in COMPOSITIONS:
+            views = spec.get(key)
+            views = views.get("spec") if isinstance(views, dict) else views
+            views = [views] if isinstance(views, dict) else views or []
+            view = next((v for v in views if isinstance(v, dict) and "mark" in v), None)
+            if view is not None:
+                spec = {**{k: v for k, v in spec.items() if k not in COMPOSITIONS}, **view}
+                break
+    spec = {k: v for k, v in spec.items() if k not in COMPOSITIONS + ("data", "spec")}
+
+    mark = spec.get("mark")
+    mark_type = mark.get("type") if isinstance(mark, dict) else mark
+    if not isinstance(mark_type, str) or mark_type.lower() not in MARKS:
+        return None
+    if isinstance(mark, dict):
+        spec["mark"] = {**mark, "type": mark_type.lower()}
+    else:
+        spec["mark"] = mark_type.lower()
+
+    columns = list(df.columns)
+    # Fields created by transforms are known too, as long as their inputs are
+    known = set(map(str, columns))
+    transforms = []
+    for transform in spec.get("transform") or []:
+        if not isinstance(transform, dict):
+            continue
+        if _transform_inputs(transform) <= known:
+            transforms.append(transform)
+            known |= _transform_outputs(transform)
+    derived = known - set(map(str, columns))
+
+    encoding = {}
+    for channel, definition in (spec.get("encoding") or {}).items():
+        if not isinstance(definition, dict):
+            continue
+        definition = dict(definition)
+        field = definition.get("field")
+        if field is not None:
+            column = _match_column(str(field), columns + sorted(derived))
+            if column is None:
+                # A chart missing a position is degenerate, regenerate instead
+                if channel in POSITIONS:
+                    return None
+                continue
+            definition["field"] = escape_field(column)
+            if definition.get("type") not in TYPES and "aggregate" not in definition:
+                definition["type"] = (
+                    "quantitative" if column in derived else _infer_type(df[column])
+                )
+        elif "aggregate" not in definition and "value" not in definition:
+            if "datum" not in definition:
+                continue
+        if definition.get("type") is not None and definition["type"] not in TYPES:
+            definition["type"] = "quantitative" if "aggregate" in definition else "nominal"
+        encoding[channel] = definition
+    if not any(channel in encoding for channel in POSITIONS + ("text",)):
+        return None
+    spec["encoding"] = encoding
+
+    if transforms:
+        spec["transform"] = transforms
+    else:
+        spec.pop("transform", None)
+    return spec
+
+
+class SpecProcessor:
+    """Turn raw model output into a valid Vega-Lite spec without regenerating
+
+    Keeps counters of how each spec was obtained so the success rate and latency
+    of the post-processing can be reported.
+    """
+
+    def __init__(self):
+        self.parsed = 0
+        self.repaired = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def process(self, text: str, df: pd.DataFrame) -> Optional[dict]:
+        """Parse, repair and validate a generated spec
+
+        Args:
+            text: raw model output.
+            df: the query result the chart is rendered with.
+
+        Returns:
+            A valid spec, or None when the model has to be re-invoked.
+        """
+        start = time.perf_counter()
+        spec, rewritten = parse_spec(text)
+        result = None
+        if spec is not None:
+            repaired = repair_spec(spec, df)
+            if repaired is not None and not validate_spec(repaired):
+                result = repaired
+                # Dropping the embedded sample data is expected, not a repair
+                rewritten = rewritten or repaired != {
+                    k: v for k, v in spec.items() if k != "data"
+                }
+        self.seconds += time.perf_counter() - start
+
+        if result is None:
+            self.failed += 1
+        elif rewritten:
+            self.repaired += 1
+        else:
+            self.parsed += 1
+        return result
+
+    def report(self) -> dict:
+        """Success rate and mean latency of the post-processing"""
+        total = self.parsed + self.repaired + self.failed
+        return {
+            "total": total,
+            "parsed": self.parsed,
+            "repaired": self.repaired,
+            "failed": self.failed,
+            "success_rate": (self.parsed + self.repaired) / total if total else 0.0,
+            "mean_ms": 1000 * self.seconds / total if total else 0.0,
+        }
+
+
+def evaluate(
+    corpus_path: str,
+    extra_cases: Iterable[Tuple[pd.DataFrame, str]] = (),
+    require_schema: bool = True,
+) -> dict:
+    """Measure the post-processing on a corpus of generated specs
+
+    The corpus is a csv with ``data`` (a dict of columns) and ``vega`` (raw model
+    output) columns, like ``bsql/viz/v1 scripts/eval_df.csv``. Besides the raw
+    outputs, each spec is also run through common corruptions of model output.
+    That corpus only has 6 specs, so ``extra_cases`` (result, spec text) pairs can
+    be added. They are reported separately under ``extra`` since specs the
+    pipeline wrote itself are valid to begin with; even the corpus rates are
+    indicative, not precise.
+
+    Raises:
+        RuntimeError: when ``require_schema`` is set and the Vega-Lite schema is
+            not available, the structural fallback would make the rates meaningless.
+    """
+    validator = _schema_validator()
+    if require_schema and validator is None:
+        raise RuntimeError("Vega-Lite schema not available, install altair")
+    corpus = pd.read_csv(corpus_path)
+    sets = {
+        "corpus": [
+            (pd.DataFrame(ast.literal_eval(row["data"])), row["vega"])
+            for _, row in corpus.iterrows()
+        ],
+        "extra": list(extra_cases),
+    }
+    corruptions = {
+        "raw": lambda text: text,
+        "single_quotes": lambda text: text.replace('"', "'"),
+        "trailing_commas": lambda text: re.sub(r"(\S)(\s*[}\]])", r"\1,\2", text),
+        "truncated": lambda text: text[: int(len(text) * 0.9)],
+        "wrapped": lambda text: f"Here is the chart:\n```json\n{text}\n```\nEnjoy!",
+    }
+    report = {"validator": "vega-lite schema" if validator else "structural"}
+    for set_name, cases in sets.items():
+        if not cases:
+            continue
+        report[set_name] = {}
+        for name, corrupt in corruptions.items():
+            processor = SpecProcessor()
+            for df, text in cases:
+                processor.process(corrupt(text), df)
+            report[set_name][name] = processor.report()
+    return report
+
+
+def _bench_cases(dataset_path: str = "data") -> List[Tuple[pd.DataFrame, str]]:
+    """Recommender specs for the benchmark questions, as pretty printed model output"""
+    from sqlite3 import connect  # pylint: disable=import-outside-toplevel
+
+    from bsql.bench.questions import QUESTIONS  # pylint: disable=import-outside-toplevel
+    from bsql.pipeline import load_data  # pylint: disable=import-outside-toplevel
+    from bsql.viz.recommender import (  # pylint: disable=import-outside-toplevel
+        ChartRecommender,
+    )
+
+    conn = connect(":memory:")
+    load_data(dataset_path, conn)
+    recommender = ChartRecommender()
+    cases = []
+    for item in QUESTIONS:
+        df = pd.read_sql(item["sql"], conn)
+        spec = recommender.recommend(df, item["question"])
+        if spec is not None:
+            cases.append((df, json.dumps(spec, indent=2)))
+    return cases
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "bsql/viz/v1 scripts/eval_df.csv"
+    print(json.dumps(evaluate(path, _bench_cases()), indent=2))
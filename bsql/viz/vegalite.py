@@ -1,9 +1,10 @@
 """Vega-Lite generator"""
 
 import torch
-from transformers import AutoTokenizer, BitsAndBytesConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 from llama_index.llms.huggingface import HuggingFaceLLM, PromptTemplate
 
+from bsql import telemetry
 from bsql.model import Model
 
 
@@ -12,32 +13,42 @@ class VegaLite(Model):
 
     Args:
         model_name: base model name.
+        snapshot_dir: prepared snapshot, already quantized to 4-bit.
 
     Returns:
         A Vega-Lite json string.
     """
 
-    def __init__(self, model_name="codellama/CodeLlama-7b-Instruct-hf"):
-        super().__init__()
+    def __init__(
+        self, model_name="codellama/CodeLlama-7b-Instruct-hf", snapshot_dir=None
+    ):
+        super().__init__(snapshot_dir)
         self.model_name = model_name
+        self.llm = None
         self.is_loaded = False
 
     def _load_model(self):
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        quantization_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_compute_dtype=torch.float16,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_use_double_quant=True,
-            load_in_8bit_fp32_cpu_offload=True,
+        self.tokenizer = AutoTokenizer.from_pretrained(self.source)
+        model_kwargs = {}
+        # A snapshot is saved quantized and its config carries the quantization
+        if self.snapshot_dir is None:
+            model_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_use_double_quant=True,
+                load_in_8bit_fp32_cpu_offload=True,
+            )
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.source, device_map="auto", **model_kwargs
         )
 
-        self.model = HuggingFaceLLM(
-            model_name=self.model_name,
+        self.llm = HuggingFaceLLM(
+            model_name=self.source,
+            model=self.model,
             tokenizer=self.tokenizer,
             query_wrapper_prompt=PromptTemplate("{query_str}"),
             max_new_tokens=512,
-            model_kwargs={"quantization_config": quantization_config},
             generate_kwargs={
                 "num_return_sequences": 1,
                 "eos_token_id": self.tokenizer.eos_token_id,
@@ -45,15 +56,19 @@ class VegaLite(Model):
                 "do_sample": False,
                 "num_beams": 1,
             },
-            device_map="auto",
         )
         self.is_loaded = True
 
     def _generate_vega(self, prompt: str) -> str:
-        if not self.is_loaded:
-            self._load_model()
-
-        response = self.model.complete(prompt).text.strip()
+        self.load_model()
+
+        # HuggingFaceLLM owns tokenization and generate, so time them as one span
+        with telemetry.span("generate"):
+            response = self.llm.complete(prompt).text.strip()
+        if telemetry.ENABLED:
+            telemetry.GENERATED_TOKENS.inc(
+                len(self.tokenizer(response)["input_ids"]), model=type(self).__name__
+            )
         torch.cuda.empty_cache()
         torch.cuda.synchronize()
         return response
@@ -1,18 +1,79 @@
 """FastAPI API for Text to SQL"""
 
-from fastapi import FastAPI
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import logging
+import time
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
+import torch
+
+from bsql import telemetry
+from bsql.prefetch import PriorityGate, Prefetcher
+from bsql.prepare import build_model
+from bsql.utils import load_config
+
+_LOG = logging.getLogger(__name__)
+_STARTED = time.perf_counter()
+
+config = load_config()
+
+sqlcoder = build_model("sqlcoder", config)
+llama = build_model("data2viz", config)
+vegalite = build_model("vegalite", config)
+MODELS = {"sqlcoder": sqlcoder, "data2viz": llama, "vegalite": vegalite}
+readiness = {name: {"ready": False} for name in MODELS}
+
+
+def _load_and_warmup(name: str):
+    """Load a model and run a warmup generate, recording its time to ready
+
+    Snapshots are read concurrently, ``load_model`` places the models on the GPU
+    one at a time so each placement sees the memory taken by the previous ones.
+    """
+    model = MODELS[name]
+    start = time.perf_counter()
+    try:
+        model.read_snapshot()
+        read = time.perf_counter()
+        model.load_model()
+        loaded = time.perf_counter()
+        if config.get("WARMUP_MODELS", True):
+            model.warmup()
+    except Exception as e:  # pylint: disable=broad-except
+        _LOG.exception("Failed to load %s", name)
+        readiness[name]["error"] = str(e)
+        return
+    ready = time.perf_counter()
+    readiness[name].update(
+        ready=True,
+        snapshot=model.snapshot_dir is not None,
+        read_s=read - start,
+        load_s=loaded - read,
+        warmup_s=ready - loaded,
+        time_to_ready_s=ready - _STARTED,
+    )
+    telemetry.MODEL_READY_SECONDS.set(ready - _STARTED, model=type(model).__name__)
+    _LOG.info("%s ready in %.1fs", name, ready - _STARTED)
+
 
-from bsql.sql.sqlcoder import SQLCoder
-from bsql.viz.llama2 import Data2Viz
-from bsql.viz.vegalite import VegaLite
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Load the models in the background without holding up the server start"""
+    executor = ThreadPoolExecutor(max_workers=config.get("MODEL_LOAD_WORKERS", 3))
+    for name in MODELS:
+        executor.submit(_load_and_warmup, name)
+    executor.shutdown(wait=False)
+    yield
 
-app = FastAPI()
 
+app = FastAPI(lifespan=lifespan)
 
-sqlcoder = SQLCoder()
-llama = Data2Viz()
-vegalite = VegaLite()
+# Interactive requests take the GPU first, follow-up SQL is prefetched when idle
+gate = PriorityGate()
+prefetcher = Prefetcher(gate, sqlcoder.inference)
 
 
 class InferenceRequest(BaseModel):
@@ -26,22 +87,71 @@ class InferenceRequest(BaseModel):
     model_name: str = "sqlcoder"
 
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Continue the caller's trace"""
+    if not telemetry.ENABLED:
+        return await call_next(request)
+
+    with telemetry.trace(request.headers.get(telemetry.TRACE_HEADER)) as trace_id:
+        response = await call_next(request)
+    response.headers[telemetry.TRACE_HEADER] = trace_id
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics"""
+    for model in MODELS.values():
+        if model.is_loaded and hasattr(model.model, "get_memory_footprint"):
+            telemetry.MODEL_MEMORY.set(
+                model.model.get_memory_footprint(), model=type(model).__name__
+            )
+    if torch.cuda.is_available():
+        telemetry.MODEL_MEMORY.set(torch.cuda.memory_allocated(), model="cuda_total")
+    return telemetry.REGISTRY.render()
+
+
 @app.get("/test")
 def test_server():
     """Test server"""
     return "Hello from Text to SQL Server"
 
 
+@app.get("/health")
+def health(response: Response):
+    """Ready once every model is loaded and warmed up, with time to ready per model"""
+    ready = all(state["ready"] for state in readiness.values())
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "models": readiness}
+
+
+@app.get("/prefetch")
+def prefetch_stats():
+    """Prefetch hit rate and wasted compute"""
+    return prefetcher.report()
+
+
 @app.post("/inference")
 def inference(request: InferenceRequest):
     """Inference"""
     if request.model_name == "sqlcoder":
-        return sqlcoder.inference(request.question, request.schema)
+        sql = prefetcher.get(request.question, request.schema)
+        if sql is not None:
+            return sql
+        with gate.interactive():
+            return sqlcoder.inference(request.question, request.schema)
 
     if request.model_name == "data2viz":
-        return vegalite.inference(request.question, request.query_result)
+        with gate.interactive():
+            return vegalite.inference(request.question, request.query_result)
 
     if request.model_name == "followup":
-        return llama.generate_followup_questions(request.question)
+        with gate.interactive():
+            questions = llama.generate_followup_questions(request.question)
+        if request.schema:
+            prefetcher.submit(questions, request.schema)
+        return questions
 
     return "Model not found"